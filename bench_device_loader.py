@@ -0,0 +1,46 @@
+import time
+import argparse
+import torch
+from torch.utils.data import DataLoader
+from data_provider.data_loader import Dataset_ETT_hour, Dataset_ETT_minute, Dataset_Custom
+from utils.windows import collate_windows, DeviceWindowLoader
+
+# one training epoch of batches from the DataLoader path and from DeviceWindowLoader, both ending on the device
+parser = argparse.ArgumentParser(description='device loader benchmark')
+parser.add_argument('--root_path', type=str, default='./dataset/ETT-small/')
+parser.add_argument('--data_path', type=str, default='ETTh1.csv')
+parser.add_argument('--features', type=str, default='M')
+parser.add_argument('--batch_size', type=int, default=32)
+parser.add_argument('--num_workers', type=int, default=4)
+parser.add_argument('--epochs', type=int, default=3)
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+args = parser.parse_args()
+
+Data = Dataset_ETT_hour if args.data_path.startswith('ETTh') else \
+    Dataset_ETT_minute if args.data_path.startswith('ETTm') else Dataset_Custom
+data_set = Data(root_path=args.root_path, data_path=args.data_path, flag='train', size=[96, 48, 96],
+                features=args.features, timeenc=1, freq='h')
+device = torch.device(args.device)
+
+
+def run(loader, to_device):
+    times = []
+    for _ in range(args.epochs):
+        start = time.time()
+        for batch in loader:
+            batch = [t.float().to(device) for t in batch] if to_device else batch
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        times.append(time.time() - start)
+    # the first epoch includes worker start-up and the upload of the device loader
+    return len(data_set) / min(times)
+
+
+loaders = {
+    'DataLoader': (DataLoader(data_set, batch_size=args.batch_size, shuffle=True, num_workers=args.num_workers,
+                              drop_last=True, collate_fn=collate_windows), True),
+    'DeviceWindowLoader': (DeviceWindowLoader(data_set, args.batch_size, shuffle=True, drop_last=True,
+                                              device=device), False),
+}
+for name, (loader, to_device) in loaders.items():
+    print('{}: {:.0f} windows/s on {}'.format(name, run(loader, to_device), device))
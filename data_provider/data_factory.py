@@ -1,5 +1,6 @@
 from data_provider.data_loader import Dataset_ETT_hour, Dataset_ETT_minute, Dataset_Custom, Dataset_M4
 from torch.utils.data import DataLoader
+from utils.windows import collate_windows, DeviceWindowLoader
 
 data_dict = {
     'ETTh1': Dataset_ETT_hour,
@@ -29,6 +30,7 @@ def data_provider(args, flag):
         batch_size = args.batch_size
         freq = args.freq
 
+    channel_batch = getattr(args, 'channel_batch', False)
     if args.data == 'm4':
         drop_last = False
         data_set = Data(
@@ -40,7 +42,8 @@ def data_provider(args, flag):
             target=args.target,
             timeenc=timeenc,
             freq=freq,
-            seasonal_patterns=args.seasonal_patterns
+            seasonal_patterns=args.seasonal_patterns,
+            storage=getattr(args, 'storage', 'memory')
         )
     else:
         data_set = Data(
@@ -53,12 +56,24 @@ def data_provider(args, flag):
             timeenc=timeenc,
             freq=freq,
             percent=percent,
-            seasonal_patterns=args.seasonal_patterns
+            seasonal_patterns=args.seasonal_patterns,
+            storage=getattr(args, 'storage', 'memory'),
+            storage_dtype=getattr(args, 'storage_dtype', 'float32'),
+            channel_batch=channel_batch
         )
+        if channel_batch:
+            # every item holds the windows of all enc_in channels, keep batches of about batch_size channel windows
+            if batch_size < data_set.enc_in:
+                raise ValueError('--channel_batch needs a batch_size of at least enc_in ({}) channel windows, got {}'
+                                 .format(data_set.enc_in, batch_size))
+            batch_size //= data_set.enc_in
+    if args.data != 'm4' and getattr(args, 'device_loader', False):
+        return data_set, DeviceWindowLoader(data_set, batch_size, shuffle=shuffle_flag, drop_last=drop_last)
     data_loader = DataLoader(
         data_set,
         batch_size=batch_size,
         shuffle=shuffle_flag,
         num_workers=args.num_workers,
-        drop_last=drop_last)
+        drop_last=drop_last,
+        collate_fn=collate_windows)
     return data_set, data_loader
@@ -3,7 +3,10 @@ import numpy as np
 import pandas as pd
 from torch.utils.data import Dataset
 from sklearn.preprocessing import StandardScaler
-from utils.timefeatures import time_features
+from utils.timefeatures import time_stamps
+from utils.storage import to_storage, allocate_memmap, freeze_memmap, storage_dtype, cast, widen
+from utils.tables import table_columns, read_table
+from utils.windows import ChannelWindows
 from data_provider.m4 import M4Dataset, M4Meta
 import warnings
 from sklearn.model_selection import train_test_split
@@ -11,11 +14,12 @@ from sklearn.model_selection import train_test_split
 warnings.filterwarnings('ignore')
 
 
-class Dataset_ETT_hour(Dataset):
+class Dataset_ETT_hour(ChannelWindows, Dataset):
     def __init__(self, root_path, flag='train', size=None,
                  features='S', data_path='ETTh1.csv',
                  target='OT', scale=True, timeenc=0, freq='h', percent=100,
-                 seasonal_patterns=None):
+                 seasonal_patterns=None, storage='memory', storage_dtype='float32',
+                 channel_batch=False):
         if size == None:
             self.seq_len = 24 * 4 * 4
             self.label_len = 24 * 4
@@ -39,6 +43,11 @@ class Dataset_ETT_hour(Dataset):
         # self.percent = percent
         self.root_path = root_path
         self.data_path = data_path
+        self.storage = storage
+        # dtype of the floating point arrays, see utils.storage.storage_dtype
+        self.storage_dtype = storage_dtype
+        # one item per time window holding all channels, instead of one per channel window
+        self.channel_batch = channel_batch
         self.__read_data__()
 
         self.enc_in = self.data_x.shape[-1]
@@ -71,49 +80,25 @@ class Dataset_ETT_hour(Dataset):
         else:
             data = df_data.values
 
-        df_stamp = df_raw[['date']][border1:border2]
-        df_stamp['date'] = pd.to_datetime(df_stamp.date)
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop(['date'], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
+        dates = pd.to_datetime(df_raw['date'][border1:border2].values)
+        data_stamp = time_stamps(dates, self.timeenc, self.freq)
 
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        self.data_x = to_storage(data[border1:border2], self.storage, storage_dtype(self.storage_dtype))
+        self.data_y = self.data_x
+        # only the values use the storage dtype, the fractional timeF stamps stay float32
+        self.data_stamp = to_storage(data_stamp, self.storage, np.float32)
 
 
-    def __getitem__(self, index):
-        feat_id = index // self.tot_len
-        s_begin = index % self.tot_len
-
-        s_end = s_begin + self.seq_len
-        r_begin = s_end - self.label_len
-        r_end = r_begin + self.label_len + self.pred_len
-        seq_x = self.data_x[s_begin:s_end, feat_id:feat_id + 1]
-        seq_y = self.data_y[r_begin:r_end, feat_id:feat_id + 1]
-        seq_x_mark = self.data_stamp[s_begin:s_end]
-        seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        return seq_x, seq_y, seq_x_mark, seq_y_mark
-
-    def __len__(self):
-        return (len(self.data_x) - self.seq_len - self.pred_len + 1) * self.enc_in
-
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
 
-class Dataset_ETT_minute(Dataset):
+class Dataset_ETT_minute(ChannelWindows, Dataset):
     def __init__(self, root_path, flag='train', size=None,
                  features='S', data_path='ETTm1.csv',
                  target='OT', scale=True, timeenc=0, freq='t', percent=100,
-                 seasonal_patterns=None):
+                 seasonal_patterns=None, storage='memory', storage_dtype='float32',
+                 channel_batch=False):
         if size == None:
             self.seq_len = 24 * 4 * 4
             self.label_len = 24 * 4
@@ -136,6 +121,11 @@ class Dataset_ETT_minute(Dataset):
 
         self.root_path = root_path
         self.data_path = data_path
+        self.storage = storage
+        # dtype of the floating point arrays, see utils.storage.storage_dtype
+        self.storage_dtype = storage_dtype
+        # one item per time window holding all channels, instead of one per channel window
+        self.channel_batch = channel_batch
         self.__read_data__()
 
         self.enc_in = self.data_x.shape[-1]
@@ -168,50 +158,23 @@ class Dataset_ETT_minute(Dataset):
         else:
             data = df_data.values
 
-        df_stamp = df_raw[['date']][border1:border2]
-        df_stamp['date'] = pd.to_datetime(df_stamp.date)
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            df_stamp['minute'] = df_stamp.date.apply(lambda row: row.minute, 1)
-            df_stamp['minute'] = df_stamp.minute.map(lambda x: x // 15)
-            data_stamp = df_stamp.drop(['date'], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
-
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
-
-    def __getitem__(self, index):
-        feat_id = index // self.tot_len
-        s_begin = index % self.tot_len
+        dates = pd.to_datetime(df_raw['date'][border1:border2].values)
+        data_stamp = time_stamps(dates, self.timeenc, self.freq, minute_step=15)
 
-        s_end = s_begin + self.seq_len
-        r_begin = s_end - self.label_len
-        r_end = r_begin + self.label_len + self.pred_len
-        seq_x = self.data_x[s_begin:s_end, feat_id:feat_id + 1]
-        seq_y = self.data_y[r_begin:r_end, feat_id:feat_id + 1]
-        seq_x_mark = self.data_stamp[s_begin:s_end]
-        seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        return seq_x, seq_y, seq_x_mark, seq_y_mark
-
-    def __len__(self):
-        return (len(self.data_x) - self.seq_len - self.pred_len + 1) * self.enc_in
+        self.data_x = to_storage(data[border1:border2], self.storage, storage_dtype(self.storage_dtype))
+        self.data_y = self.data_x
+        self.data_stamp = to_storage(data_stamp, self.storage, np.float32)
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
 
-class Dataset_Custom(Dataset):
+class Dataset_Custom(ChannelWindows, Dataset):
     def __init__(self, root_path, flag='train', size=None,
                  features='S', data_path='ETTh1.csv',
                  target='OT', scale=True, timeenc=0, freq='h', percent=100,
-                 seasonal_patterns=None):
+                 seasonal_patterns=None, storage='memory', storage_dtype='float32',
+                 channel_batch=False, chunksize=100000):
         if size == None:
             self.seq_len = 24 * 4 * 4
             self.label_len = 24 * 4
@@ -234,23 +197,32 @@ class Dataset_Custom(Dataset):
 
         self.root_path = root_path
         self.data_path = data_path
-        self.__read_data__()
+        self.storage = storage
+        # dtype of the floating point arrays, see utils.storage.storage_dtype
+        self.storage_dtype = storage_dtype
+        # one item per time window holding all channels, instead of one per channel window
+        self.channel_batch = channel_batch
+        self.chunksize = chunksize
+        if self.storage == 'stream' and self.data_path.endswith('.csv'):
+            self.__stream_data__()
+        else:
+            self.__read_data__()
 
         self.enc_in = self.data_x.shape[-1]
         self.tot_len = len(self.data_x) - self.seq_len - self.pred_len + 1
 
     def __read_data__(self):
         self.scaler = StandardScaler()
-        df_raw = pd.read_csv(os.path.join(self.root_path,
-                                          self.data_path))
+        path = os.path.join(self.root_path, self.data_path)
 
         '''
         df_raw.columns: ['date', ...(other features), target feature]
         '''
-        cols = list(df_raw.columns)
+        cols = table_columns(path)
         cols.remove(self.target)
         cols.remove('date')
-        df_raw = df_raw[['date'] + cols + [self.target]]
+        # only the columns of the features are read
+        df_raw = read_table(path, ['date'] + (cols if self.features == 'M' or self.features == 'MS' else []) + [self.target])
         num_train = int(len(df_raw) * 0.7)
         num_test = int(len(df_raw) * 0.2)
         num_vali = len(df_raw) - num_train - num_test
@@ -275,41 +247,62 @@ class Dataset_Custom(Dataset):
         else:
             data = df_data.values
 
-        df_stamp = df_raw[['date']][border1:border2]
-        df_stamp['date'] = pd.to_datetime(df_stamp.date)
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop(['date'], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
-
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        dates = pd.to_datetime(df_raw['date'][border1:border2].values)
+        data_stamp = time_stamps(dates, self.timeenc, self.freq)
 
-    def __getitem__(self, index):
-        feat_id = index // self.tot_len
-        s_begin = index % self.tot_len
+        self.data_x = to_storage(data[border1:border2], self.storage, storage_dtype(self.storage_dtype))
+        self.data_y = self.data_x
+        self.data_stamp = to_storage(data_stamp, self.storage, np.float32)
 
-        s_end = s_begin + self.seq_len
-        r_begin = s_end - self.label_len
-        r_end = r_begin + self.label_len + self.pred_len
-        seq_x = self.data_x[s_begin:s_end, feat_id:feat_id + 1]
-        seq_y = self.data_y[r_begin:r_end, feat_id:feat_id + 1]
-        seq_x_mark = self.data_stamp[s_begin:s_end]
-        seq_y_mark = self.data_stamp[r_begin:r_end]
+    def __stream_data__(self):
+        """
+        Chunked variant of __read_data__ for csv files that do not fit in memory. The file is read three
+        times, chunksize rows at a time: once for the timestamps (which also gives the number of rows), once
+        to fit the scaler incrementally on the training rows and once to write the normalized rows
+        of this split into a memory-mapped array. Only the timestamps are held for the whole file.
+        Columnar files are read column-projected by __read_data__ and memory-mapped instead.
+        """
+        self.scaler = StandardScaler()
+        path = os.path.join(self.root_path, self.data_path)
+        cols = list(pd.read_csv(path, nrows=0).columns)
+        cols.remove(self.target)
+        cols.remove('date')
+        cols_data = cols + [self.target] if self.features == 'M' or self.features == 'MS' else [self.target]
+
+        dates = np.concatenate([pd.to_datetime(chunk['date']).values
+                                for chunk in pd.read_csv(path, usecols=['date'], chunksize=self.chunksize)])
+        num_train = int(len(dates) * 0.7)
+        num_test = int(len(dates) * 0.2)
+        num_vali = len(dates) - num_train - num_test
+        border1s = [0, num_train - self.seq_len, len(dates) - num_test - self.seq_len]
+        border2s = [num_train, num_train + num_vali, len(dates)]
+        border1 = border1s[self.set_type]
+        border2 = border2s[self.set_type]
 
-        return seq_x, seq_y, seq_x_mark, seq_y_mark
+        if self.set_type == 0:
+            border2 = (border2 - self.seq_len) * self.percent // 100 + self.seq_len
 
-    def __len__(self):
-        return (len(self.data_x) - self.seq_len - self.pred_len + 1) * self.enc_in
+        if self.scale:
+            for chunk in pd.read_csv(path, usecols=cols_data, nrows=border2s[0], chunksize=self.chunksize):
+                self.scaler.partial_fit(chunk[cols_data].values)
+
+        data = allocate_memmap((border2 - border1, len(cols_data)), storage_dtype(self.storage_dtype))
+        row = 0
+        for chunk in pd.read_csv(path, usecols=cols_data, skiprows=range(1, border1 + 1), nrows=border2 - border1,
+                                 chunksize=self.chunksize):
+            values = chunk[cols_data].values
+            data[row:row + len(values)] = cast(self.scaler.transform(values) if self.scale else values,
+                                               data.dtype)
+            row += len(values)
+
+        data_stamp = time_stamps(pd.DatetimeIndex(dates[border1:border2]), self.timeenc, self.freq)
+
+        self.data_x = freeze_memmap(data)
+        self.data_y = self.data_x
+        self.data_stamp = to_storage(data_stamp, 'memmap', np.float32)
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
 
 
@@ -319,7 +312,7 @@ class Dataset_M4(Dataset):
     def __init__(self, root_path, flag='pred', size=None,
                  features='S', data_path='ETTh1.csv',
                  target='OT', scale=False, inverse=False, timeenc=0, freq='15min',
-                 seasonal_patterns='Yearly'):
+                 seasonal_patterns='Yearly', storage='memory'):
         self.features = features
         self.target = target
         self.scale = scale
@@ -335,6 +328,8 @@ class Dataset_M4(Dataset):
         self.history_size = M4Meta.history_size[seasonal_patterns]
         self.window_sampling_limit = int(self.history_size * self.pred_len)
         self.flag = flag
+        # backing of the packed series, see utils.storage.to_storage
+        self.storage = storage
 
         self.__read_data__()
 
@@ -344,59 +339,67 @@ class Dataset_M4(Dataset):
             dataset = M4Dataset.load(training=True, dataset_file=self.root_path)
         else:
             dataset = M4Dataset.load(training=False, dataset_file=self.root_path)
-        training_values = np.array(
-            [v[~np.isnan(v)] for v in
-             dataset.values[dataset.groups == self.seasonal_patterns]])  # split different frequencies
+        training_values = [v[~np.isnan(v)] for v in
+                           dataset.values[dataset.groups == self.seasonal_patterns]]  # split different frequencies
         self.ids = np.array([i for i in dataset.ids[dataset.groups == self.seasonal_patterns]])
-        self.timeseries = [ts for ts in training_values]
+        # packed series: series i is values[offsets[i]:offsets[i + 1]], timeseries holds views of it
+        self.lengths = np.array([len(v) for v in training_values], dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+        self.values = to_storage(np.concatenate(training_values) if training_values else np.zeros(0), self.storage)
+        self.timeseries = np.split(self.values, self.offsets[1:-1]) if training_values else []
 
     def __getitem__(self, index):
-        insample = np.zeros((self.seq_len, 1))
-        insample_mask = np.zeros((self.seq_len, 1))
-        outsample = np.zeros((self.pred_len + self.label_len, 1))
-        outsample_mask = np.zeros((self.pred_len + self.label_len, 1))  # m4 dataset
-
-        sampled_timeseries = self.timeseries[index]
-        cut_point = np.random.randint(low=max(1, len(sampled_timeseries) - self.window_sampling_limit),
-                                      high=len(sampled_timeseries),
-                                      size=1)[0]
-
-        insample_window = sampled_timeseries[max(0, cut_point - self.seq_len):cut_point]
-        insample[-len(insample_window):, 0] = insample_window
-        insample_mask[-len(insample_window):, 0] = 1.0
-        outsample_window = sampled_timeseries[
-                           cut_point - self.label_len:min(len(sampled_timeseries), cut_point + self.pred_len)]
-        outsample[:len(outsample_window), 0] = outsample_window
-        outsample_mask[:len(outsample_window), 0] = 1.0
-        return insample, outsample, insample_mask, outsample_mask
+        return tuple(window[0] for window in self.__getitems__([index]))
+
+    def __getitems__(self, indices):
+        # one cut point per series from a single RNG call, windows gathered from the packed values
+        indices = np.asarray(indices)
+        lengths = self.lengths[indices][:, None]
+        offsets = self.offsets[indices][:, None]
+        cut_points = np.random.randint(low=np.maximum(1, lengths - self.window_sampling_limit),
+                                       high=lengths)
+
+        positions = cut_points - self.seq_len + np.arange(self.seq_len)
+        insample_mask = positions >= 0
+        insample = np.where(insample_mask, self.values[offsets + np.maximum(positions, 0)], 0.0)
+
+        # same bounds as the slice ts[cut_point - label_len:cut_point + pred_len], including its
+        # negative start for cut points before label_len, which counts from the end of the series
+        starts = cut_points - self.label_len
+        starts = np.where(starts < 0, np.maximum(starts + lengths, 0), starts)
+        ends = np.minimum(lengths, cut_points + self.pred_len)
+        positions = starts + np.arange(self.label_len + self.pred_len)
+        outsample_mask = positions < ends
+        outsample = np.where(outsample_mask, self.values[offsets + np.minimum(positions, lengths - 1)], 0.0)
+        return (insample[..., None], outsample[..., None],
+                insample_mask[..., None].astype(np.float64), outsample_mask[..., None].astype(np.float64))
 
     def __len__(self):
         return len(self.timeseries)
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
     def last_insample_window(self):
         """
         The last window of insample size of all timeseries.
         This function does not support batching and does not reshuffle timeseries.
+        Series shorter than the insample size are left-padded with zeros.
 
         :return: Last insample window of all timeseries. Shape "timeseries, insample size"
         """
-        insample = np.zeros((len(self.timeseries), self.seq_len))
-        insample_mask = np.zeros((len(self.timeseries), self.seq_len))
-        for i, ts in enumerate(self.timeseries):
-            ts_last_window = ts[-self.seq_len:]
-            insample[i, -len(ts):] = ts_last_window
-            insample_mask[i, -len(ts):] = 1.0
-        return insample, insample_mask
+        lengths = self.lengths[:, None]
+        positions = lengths - self.seq_len + np.arange(self.seq_len)
+        insample_mask = positions >= 0
+        insample = np.where(insample_mask, self.values[self.offsets[:-1, None] + np.maximum(positions, 0)], 0.0)
+        return insample, insample_mask.astype(np.float64)
 
 
 class DatasetPerIndividual(Dataset):
     def __init__(self, df, individual_id, flag='train', size=None, stride=1,
                  features='S', data_path='ETTh1.csv',
                  target='OT', scale=True, timeenc=0, freq='h', train_percent=100, val_percent=0,
-                 seasonal_patterns=None, time_column='DateTime', covariates=None):
+                 seasonal_patterns=None, time_column='DateTime', covariates=None, stamps=None, storage='memory', storage_dtype='float32'):
         if size is None:
             self.seq_len = 24 * 4 * 4
             self.label_len = 24 * 4
@@ -423,6 +426,11 @@ class DatasetPerIndividual(Dataset):
         self.data_path = data_path
         self.time_column = time_column
         self.stride = stride
+        self.storage = storage
+        # dtype of the floating point arrays, see utils.storage.storage_dtype
+        self.storage_dtype = storage_dtype
+        # time features of the rows of df, computed by the caller once for all segments
+        self.stamps = stamps
 
         self.__read_data__(df)
         self.enc_in = self.data_x.shape[-1]
@@ -461,21 +469,15 @@ class DatasetPerIndividual(Dataset):
         else:
             data = df_data.values
 
-        df_stamp = df_raw[[self.time_column]][border1:border2]
-        df_stamp[self.time_column] = pd.to_datetime(df_stamp[self.time_column])
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp[self.time_column].apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp[self.time_column].apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp[self.time_column].apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp[self.time_column].apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop([self.time_column], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp[self.time_column].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
-
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        if self.stamps is None:
+            dates = pd.to_datetime(df_raw[self.time_column][border1:border2].values)
+            data_stamp = time_stamps(dates, self.timeenc, self.freq)
+        else:
+            data_stamp = self.stamps[border1:border2]
+
+        self.data_x = to_storage(data[border1:border2], self.storage, storage_dtype(self.storage_dtype))
+        self.data_y = self.data_x
+        self.data_stamp = to_storage(data_stamp, self.storage, np.float32)
 
     def __getitem__(self, index):
         s_begin = index * self.stride
@@ -483,8 +485,8 @@ class DatasetPerIndividual(Dataset):
         r_begin = s_end - self.label_len
         r_end = r_begin + self.label_len + self.pred_len
 
-        seq_x = self.data_x[s_begin:s_end, :]
-        seq_y = self.data_y[r_begin:r_end, :]
+        seq_x = widen(self.data_x[s_begin:s_end, :])
+        seq_y = widen(self.data_y[r_begin:r_end, :])
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
 
@@ -494,7 +496,7 @@ class DatasetPerIndividual(Dataset):
         return (len(self.data_x) - self.seq_len - self.pred_len) // self.stride + 1
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
 class Dataset_Combined(Dataset):
     def __init__(self, root_path, flag='train', size=None,
@@ -567,7 +569,8 @@ class Dataset_Combined(Dataset):
             to_be_scaled = df_raw[[self.target]] if self.features == 'S' else df_raw.iloc[:,2:]
             new_data = self.scaler.fit_transform(to_be_scaled)
             df_raw.iloc[:, 2:] = new_data
-        
+        # time features of all rows at once, sliced per segment below
+        stamps = time_stamps(pd.to_datetime(df_raw['LBDTC'].values), self.timeenc, self.freq)
 
         for individual_id in self.ids:
             df_per_indiv = df_raw[df_raw['USUBJID'] == individual_id]
@@ -585,11 +588,11 @@ class Dataset_Combined(Dataset):
                 if self.partition == 'individual':
                     self.datasets.append(DatasetPerIndividual(df_split, individual_id, 'train', self.size, self.stride, self.features, self.data_path,
                                                              self.target, self.scale if self.normalization =='individual' else False, self.timeenc,
-                                                             self.freq, 100, 0))
+                                                             self.freq, 100, 0, stamps=stamps[df_split.index.values]))
                 elif self.partition == 'chronological':
                     self.datasets.append(DatasetPerIndividual(df_split, individual_id, self.flag, self.size, self.stride, self.features, self.data_path,
                                                              self.target, self.scale if self.normalization =='individual' else False, self.timeenc,
-                                                             self.freq, self.train_percent, self.val_percent))
+                                                             self.freq, self.train_percent, self.val_percent, stamps=stamps[df_split.index.values]))
                 else:
                     raise ValueError('Invalid partition type: {}'.format(self.partition))
         
@@ -608,7 +611,7 @@ class Dataset_Combined(Dataset):
         return self.datasets[dataset_idx].__getitem__(dataset_index)
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
 
 
@@ -1,10 +1,13 @@
 from torch.utils.data import DataLoader
 
 from data_provider_pretrain.data_loader import Dataset_ETT_hour, Dataset_ETT_minute, Dataset_Combined
+from data_provider_pretrain.glucose_source import GlucoseSource
 import torch
 from torch_frame.utils import cat
 from torch.utils.data.dataloader import default_collate
 import numpy as np
+from utils.windows import collate_windows, DeviceWindowLoader
+from data_provider_pretrain.samplers import WindowSampler
 data_dict = {
     'ETTh1': Dataset_ETT_hour,
     'ETTh2': Dataset_ETT_hour,
@@ -13,11 +16,44 @@ data_dict = {
     'Glucose': Dataset_Combined,
 }
 
-def __build_collate_fn__(cov_frame):
+# the glucose source of the last run, shared by its train/val/test calls of data_provider
+__glucose_source__ = {}
+
+
+def __get_glucose_source__(args):
+    key = (args.root_path, args.data_path, args.seq_len, args.label_len, args.pred_len, args.features,
+           args.freq, args.enable_covariates, args.num_individuals, args.cache_dir, args.storage, args.data_columns,
+           args.preprocess_workers, args.storage_dtype, args.gap_tolerance, args.cadence)
+    if key not in __glucose_source__:
+        __glucose_source__.clear()
+        __glucose_source__[key] = GlucoseSource(root_path=args.root_path,
+                                                data_path=args.data_path,
+                                                target='Glucose',
+                                                size=[args.seq_len, args.label_len, args.pred_len],
+                                                normalization='global',
+                                                freq=args.freq,
+                                                features=args.features,
+                                                enable_covariates=args.enable_covariates,
+                                                num_individuals=args.num_individuals,
+                                                cache_dir=args.cache_dir,
+                                                storage=args.storage,
+                                                storage_dtype=args.storage_dtype,
+                                                gap_tolerance=args.gap_tolerance,
+                                                cadence=args.cadence,
+                                                columns=args.data_columns.split(',') if args.data_columns else None,
+                                                preprocess_workers=args.preprocess_workers)
+    return __glucose_source__[key]
+
+def __build_collate_fn__(cov_type=None):
+    # the datasets gather whole batches in __getitems__, so collate only turns them into tensors;
+    # tensor covariates travel as rows of the covariate table (args.cov_frame), which the model encodes
     def collate_fn(batch):
-        time_series, idx = default_collate(batch)
-        covariates = cov_frame[idx]
-        return time_series, covariates
+        if cov_type is None:
+            return collate_windows(batch)
+        time_series, covariates = batch
+        if cov_type == 'tensor':
+            return collate_windows(time_series), torch.from_numpy(covariates)
+        return collate_windows(time_series), default_collate(covariates)
     return collate_fn
 
 def data_provider(args, data, data_path, pretrain=True, flag='train'):
@@ -35,6 +71,8 @@ def data_provider(args, data, data_path, pretrain=True, flag='train'):
         batch_size = args.batch_size
         freq = args.freq
     if data == 'Glucose':
+        if args.channel_batch:
+            raise ValueError('channel batching is only supported by the channel-independent ETT datasets')
         data_set = Dataset_Combined(root_path=args.root_path, 
                             flag=flag, 
                             data_path= args.data_path,
@@ -44,7 +82,9 @@ def data_provider(args, data, data_path, pretrain=True, flag='train'):
                             freq=args.freq,
                             features=args.features, 
                             enable_covariates=args.enable_covariates,
-                            num_individuals=args.num_individuals,)
+                            num_individuals=args.num_individuals,
+                            source=__get_glucose_source__(args),
+                            return_missing=getattr(args, 'mask_missing', False))
 
     else:
         data_set = Data(
@@ -58,16 +98,44 @@ def data_provider(args, data, data_path, pretrain=True, flag='train'):
             freq=freq,
             percent=percent,
             seasonal_patterns=args.seasonal_patterns,
-            pretrain=pretrain
+            pretrain=pretrain,
+            storage=args.storage,
+            storage_dtype=args.storage_dtype,
+            channel_batch=args.channel_batch
         )
-    data_loader = DataLoader(
-        data_set,
-        batch_size=batch_size // args.num_nodes,
-        shuffle=shuffle_flag,
-        num_workers=args.num_workers,
-        drop_last=drop_last, 
-        collate_fn=__build_collate_fn__(data_set.processed_covariates.tensor_frame) if (args.enable_covariates and args.cov_type =='tensor') else None)
+        if args.channel_batch:
+            # every item holds the windows of all enc_in channels, keep batches of about batch_size channel windows
+            if batch_size < data_set.enc_in:
+                raise ValueError('--channel_batch needs a batch_size of at least enc_in ({}) channel windows, got {}'
+                                 .format(data_set.enc_in, batch_size))
+            batch_size //= data_set.enc_in
+    sampler = None
+    if flag == 'train' and (args.sampler != 'none' or args.segment_cap or args.epoch_windows):
+        if data != 'Glucose':
+            raise ValueError('window samplers are only supported by the Glucose dataset')
+        sampler = WindowSampler(data_set, balance=None if args.sampler == 'none' else args.sampler,
+                                segment_cap=args.segment_cap, num_samples=args.epoch_windows)
+    cov_type = args.cov_type if args.enable_covariates else None
+    if args.device_loader:
+        if cov_type == 'text':
+            raise ValueError('the device loader does not support text covariates')
+        if getattr(args, 'mask_missing', False):
+            raise ValueError('the device loader does not return missing masks')
+        covariates = data_set.window_covariates() if cov_type == 'tensor' else None
+        data_loader = DeviceWindowLoader(data_set, batch_size // args.num_nodes, shuffle=shuffle_flag,
+                                         drop_last=drop_last, covariates=covariates, sampler=sampler)
+    else:
+        data_loader = DataLoader(
+            data_set,
+            batch_size=batch_size // args.num_nodes,
+            shuffle=shuffle_flag and sampler is None,
+            sampler=sampler,
+            num_workers=args.num_workers,
+            drop_last=drop_last, 
+            pin_memory=torch.cuda.is_available(),
+            collate_fn=__build_collate_fn__(cov_type))
     if args.enable_covariates and args.cov_type == 'tensor':
         args.col_names_dict = data_set.processed_covariates.tensor_frame.col_names_dict
         args.col_stats = data_set.processed_covariates.col_stats
+        args.cov_frame = data_set.processed_covariates.tensor_frame
     return data_set, data_loader, args
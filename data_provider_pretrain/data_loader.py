@@ -2,22 +2,26 @@ import os
 import pandas as pd
 from torch.utils.data import Dataset
 from sklearn.preprocessing import StandardScaler
-from utils.timefeatures import time_features
+from utils.timefeatures import time_stamps
+from utils.storage import to_storage, storage_dtype, widen
+from utils.windows import gather_windows, gather_batch, ChannelWindows
 import warnings
 import numpy as np
 from sklearn.model_selection import train_test_split
 import torch_frame
 from torch_frame.data import Dataset
+from data_provider_pretrain.glucose_source import GlucoseSource
 warnings.filterwarnings('ignore')
 import tqdm
 
 
 
-class Dataset_ETT_hour(Dataset):
+class Dataset_ETT_hour(ChannelWindows, Dataset):
     def __init__(self, root_path, flag='train', size=None,
                  features='S', data_path='ETTh1.csv',
                  target='OT', scale=True, timeenc=0, freq='h', percent=100,
-                 seasonal_patterns=None, pretrain=True):
+                 seasonal_patterns=None, pretrain=True, storage='memory', storage_dtype='float32',
+                 channel_batch=False):
         if size == None:
             self.seq_len = 24 * 4 * 4
             self.label_len = 24 * 4
@@ -42,6 +46,11 @@ class Dataset_ETT_hour(Dataset):
         # self.percent = percent
         self.root_path = root_path
         self.data_path = data_path
+        self.storage = storage
+        # dtype of the floating point arrays, see utils.storage.storage_dtype
+        self.storage_dtype = storage_dtype
+        # one item per time window holding all channels, instead of one per channel window
+        self.channel_batch = channel_batch
         self.__read_data__()
 
         self.enc_in = self.data_x.shape[-1]
@@ -80,48 +89,24 @@ class Dataset_ETT_hour(Dataset):
         else:
             data = df_data.values
 
-        df_stamp = df_raw[['date']][border1:border2]
-        df_stamp['date'] = pd.to_datetime(df_stamp.date)
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop(['date'], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
-
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        dates = pd.to_datetime(df_raw['date'][border1:border2].values)
+        data_stamp = time_stamps(dates, self.timeenc, self.freq)
 
-    def __getitem__(self, index):
-        feat_id = index // self.tot_len
-        s_begin = index % self.tot_len
-
-        s_end = s_begin + self.seq_len
-        r_begin = s_end - self.label_len
-        r_end = r_begin + self.label_len + self.pred_len
-        seq_x = self.data_x[s_begin:s_end, feat_id:feat_id + 1]
-        seq_y = self.data_y[r_begin:r_end, feat_id:feat_id + 1]
-        seq_x_mark = self.data_stamp[s_begin:s_end]
-        seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        return seq_x, seq_y, seq_x_mark, seq_y_mark
-
-    def __len__(self):
-        return (len(self.data_x) - self.seq_len - self.pred_len + 1) * self.enc_in
+        self.data_x = to_storage(data[border1:border2], self.storage, storage_dtype(self.storage_dtype))
+        self.data_y = self.data_x
+        # only the values use the storage dtype, the fractional timeF stamps stay float32
+        self.data_stamp = to_storage(data_stamp, self.storage, np.float32)
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
 
-class Dataset_ETT_minute(Dataset):
+class Dataset_ETT_minute(ChannelWindows, Dataset):
     def __init__(self, root_path, flag='train', size=None,
                  features='S', data_path='ETTm1.csv',
                  target='OT', scale=True, timeenc=0, freq='t', percent=100,
-                 seasonal_patterns=None, pretrain=True):
+                 seasonal_patterns=None, pretrain=True, storage='memory', storage_dtype='float32',
+                 channel_batch=False):
         if size == None:
             self.seq_len = 24 * 4 * 4
             self.label_len = 24 * 4
@@ -145,6 +130,11 @@ class Dataset_ETT_minute(Dataset):
 
         self.root_path = root_path
         self.data_path = data_path
+        self.storage = storage
+        # dtype of the floating point arrays, see utils.storage.storage_dtype
+        self.storage_dtype = storage_dtype
+        # one item per time window holding all channels, instead of one per channel window
+        self.channel_batch = channel_batch
         self.__read_data__()
 
         self.enc_in = self.data_x.shape[-1]
@@ -187,50 +177,22 @@ class Dataset_ETT_minute(Dataset):
         else:
             data = df_data.values
 
-        df_stamp = df_raw[['date']][border1:border2]
-        df_stamp['date'] = pd.to_datetime(df_stamp.date)
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            df_stamp['minute'] = df_stamp.date.apply(lambda row: row.minute, 1)
-            df_stamp['minute'] = df_stamp.minute.map(lambda x: x // 15)
-            data_stamp = df_stamp.drop(['date'], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
-
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
-
-    def __getitem__(self, index):
-        feat_id = index // self.tot_len
-        s_begin = index % self.tot_len
-
-        s_end = s_begin + self.seq_len
-        r_begin = s_end - self.label_len
-        r_end = r_begin + self.label_len + self.pred_len
-        seq_x = self.data_x[s_begin:s_end, feat_id:feat_id + 1]
-        seq_y = self.data_y[r_begin:r_end, feat_id:feat_id + 1]
-        seq_x_mark = self.data_stamp[s_begin:s_end]
-        seq_y_mark = self.data_stamp[r_begin:r_end]
+        dates = pd.to_datetime(df_raw['date'][border1:border2].values)
+        data_stamp = time_stamps(dates, self.timeenc, self.freq, minute_step=15)
 
-        return seq_x, seq_y, seq_x_mark, seq_y_mark
-
-    def __len__(self):
-        return (len(self.data_x) - self.seq_len - self.pred_len + 1) * self.enc_in
+        self.data_x = to_storage(data[border1:border2], self.storage, storage_dtype(self.storage_dtype))
+        self.data_y = self.data_x
+        self.data_stamp = to_storage(data_stamp, self.storage, np.float32)
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
 
 class DatasetPerIndividual(Dataset):
     def __init__(self, df, individual_id, flag='train', size=None, stride=1,
                  features='S', data_path='ETTh1.csv',
                  target='OT', scale=True, timeenc=1, freq='t', train_percent=100, val_percent=0,
-                 seasonal_patterns=None, time_column='DateTime', covariates=None, cov_index=None):
+                 seasonal_patterns=None, time_column='DateTime', covariates=None, stamps=None, cov_index=None, storage='memory', storage_dtype='float32'):
         if size is None:
             self.seq_len = 24 * 4 * 4
             self.label_len = 24 * 4
@@ -257,6 +219,11 @@ class DatasetPerIndividual(Dataset):
         self.data_path = data_path
         self.time_column = time_column
         self.stride = stride
+        self.storage = storage
+        # dtype of the floating point arrays, see utils.storage.storage_dtype
+        self.storage_dtype = storage_dtype
+        # time features of the rows of df, computed by the caller once for all segments
+        self.stamps = stamps
 
         self.__read_data__(df)
         self.enc_in = self.data_x.shape[-1]
@@ -295,21 +262,15 @@ class DatasetPerIndividual(Dataset):
         else:
             data = df_data.values
 
-        df_stamp = df_raw[[self.time_column]][border1:border2]
-        df_stamp[self.time_column] = pd.to_datetime(df_stamp[self.time_column])
-        if self.timeenc == 0:
-            df_stamp['month'] = df_stamp[self.time_column].apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp[self.time_column].apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp[self.time_column].apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp[self.time_column].apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop([self.time_column], 1).values
-        elif self.timeenc == 1:
-            data_stamp = time_features(pd.to_datetime(df_stamp[self.time_column].values), freq=self.freq)
-            data_stamp = data_stamp.transpose(1, 0)
-
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        if self.stamps is None:
+            dates = pd.to_datetime(df_raw[self.time_column][border1:border2].values)
+            data_stamp = time_stamps(dates, self.timeenc, self.freq)
+        else:
+            data_stamp = self.stamps[border1:border2]
+
+        self.data_x = to_storage(data[border1:border2], self.storage, storage_dtype(self.storage_dtype))
+        self.data_y = self.data_x
+        self.data_stamp = to_storage(data_stamp, self.storage, np.float32)
 
     def __getitem__(self, index):
         s_begin = index * self.stride
@@ -317,8 +278,8 @@ class DatasetPerIndividual(Dataset):
         r_begin = s_end - self.label_len
         r_end = r_begin + self.label_len + self.pred_len
 
-        seq_x = self.data_x[s_begin:s_end, :]
-        seq_y = self.data_y[r_begin:r_end, :]
+        seq_x = widen(self.data_x[s_begin:s_end, :])
+        seq_y = widen(self.data_y[r_begin:r_end, :])
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
 
@@ -329,7 +290,7 @@ class DatasetPerIndividual(Dataset):
         return length if length > 0 else 0
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
 
 class Dataset_Combined(Dataset):
     def __init__(self, root_path, flag='train', size=None,
@@ -340,7 +301,9 @@ class Dataset_Combined(Dataset):
                  gap_tolerance = '5 minute', 
                  time_column = 'DateTime', 
                  enable_covariates = False, 
-                 cov_path = 'final_dm.csv', num_individuals = -1, stride = 1, cov_type = 'tensor'):
+                 cov_path = 'final_dm.csv', num_individuals = -1, stride = 1, cov_type = 'tensor', source = None,
+                 cache_dir = None, storage = 'memory', columns = None, preprocess_workers = 0, storage_dtype = 'float32',
+                 cadence = None, return_missing = False):
         if size == None:
             self.seq_len = 24 * 4 * 4
             self.label_len = 24 * 4
@@ -363,7 +326,6 @@ class Dataset_Combined(Dataset):
         self.freq = freq
         self.train_percent = train_percent
         self.val_percent = val_percent
-        self.datasets = []
         self.root_path = root_path
         self.data_path = data_path
         self.partition = partition
@@ -375,152 +337,203 @@ class Dataset_Combined(Dataset):
         self.num_individuals = num_individuals
         self.stride = stride
         self.cov_type = cov_type
-
+        # also return the mask of the interpolated rows of seq_y (see GlucoseSource cadence) as a fifth window
+        self.return_missing = return_missing
+
+        if source is None:
+            source = GlucoseSource(root_path, data_path=data_path, size=size, features=features, target=target,
+                                   scale=scale, train_percent=train_percent, val_percent=val_percent,
+                                   partition=partition, normalization=normalization,
+                                   gap_tolerance=gap_tolerance, time_column=time_column,
+                                   timeenc=timeenc, freq=freq, enable_covariates=enable_covariates, cov_path=cov_path,
+                                   num_individuals=num_individuals, cache_dir=cache_dir, storage=storage,
+                                   columns=columns, preprocess_workers=preprocess_workers,
+                                   storage_dtype=storage_dtype, cadence=cadence)
+        self.source = source
+        self.ids = source.split_ids[flag]
+        if self.normalization == 'global' and self.scale:
+            self.scaler = source.scaler
         if self.enable_covariates:
-            self.covariates = pd.read_csv(os.path.join(self.root_path, self.cov_path))
-            self.covariates_preprocess()
-        if partition == 'individual':
-        # Partition the individual IDs
-            train_ids, val_ids, test_ids = self.__partition_individuals(train_percent, val_percent)
-            self.ids = train_ids if flag == 'train' else val_ids if flag == 'val' else test_ids
-        elif partition == 'chronological' or partition == 'chronological-2':
-            self.ids = pd.read_csv(os.path.join(self.root_path, self.data_path))['USUBJID'].unique()
-        else:
-            raise ValueError('Invalid partition type: {}'.format(partition))
-        
+            self.covariates = source.covariates
+            self.processed_covariates = source.processed_covariates
 
         self.__read_data__()
-    
-    def covariates_preprocess(self):
-        assert self.enable_covariates, 'Covariates are not enabled'
-        # Specify the stype of each column with a dictionary.
-        col_to_stype = {
-            "SEX": torch_frame.categorical, 
-            "RACE": torch_frame.categorical,
-            "ETHNIC": torch_frame.categorical, 
-            "ARMCD": torch_frame.categorical,
-            "insulin modality": torch_frame.categorical,
-            "AGE": torch_frame.numerical, 
-            "WEIGHT": torch_frame.numerical, 
-            "HEIGHT": torch_frame.numerical,
-            "HbA1c": torch_frame.numerical, 
-            "DIABETES_ONSET": torch_frame.numerical,
-        }
-        # Set "target" as the target column.
-        dataset = Dataset(self.covariates, col_to_stype=col_to_stype)
-        dataset.materialize() # tensorize the data
-        self.processed_covariates = dataset
-
-
-    def __partition_individuals(self, train_percent, val_percent):
-        df_raw = pd.read_csv(os.path.join(self.root_path, self.data_path))
-        individual_ids = df_raw['USUBJID'].unique()
-        
-        # Calculate validation and test set percentages
-        val_percent_adj = val_percent / (100 - train_percent) * 100 if train_percent < 100 else val_percent
-        test_percent_adj = 100 - val_percent_adj
-        
-        # Split the unique IDs into train and temp sets
-        train_ids, temp_ids = train_test_split(individual_ids, train_size=train_percent/100, random_state=42)
-        
-        # Split the temp set into validation and test sets
-        val_ids, test_ids = train_test_split(temp_ids, test_size=test_percent_adj/100, random_state=42)
-        
-        return train_ids, val_ids, test_ids
-    
-    def __read_data__(self):
-        df_raw = pd.read_csv(os.path.join(self.root_path, self.data_path))
-        # sanity checks
-        assert 'USUBJID' in df_raw.columns, 'USUBJID column not found in the dataset'
-        assert self.target in df_raw.columns, 'Target column not found in the dataset'
-        assert self.time_column in df_raw.columns, 'Time column not found in the dataset'
-        # reorder columns into Time, USUBJID, features_column, target_column
-        df_raw = df_raw[[self.time_column, 'USUBJID'] + [col for col in df_raw.columns if col not in [self.time_column,'USUBJID', self.target]] + [self.target]]
-        if self.normalization == 'global' and self.scale: #TODO: Global normalization is not correct here as it is taking into account the test set
-            self.scaler = StandardScaler()
-            to_be_scaled = df_raw[[self.target]] if self.features == 'S' else df_raw.iloc[:,2:]
-            new_data = self.scaler.fit_transform(to_be_scaled)
-            # print the mean and std of each column
-            print('Mean:', self.scaler.mean_)
-            print('Std:', self.scaler.scale_)
-            
-            if self.features == 'S':
-                df_raw[self.target] = new_data
-            else:
-                df_raw.iloc[:, 2:] = new_data
-        
-        if self.num_individuals >= 0: # -1 means all individuals
-            self.ids = self.ids[:self.num_individuals]
-
-        print('Loading data into memory...')
-        for individual_id in tqdm.tqdm(self.ids):
-            df_per_indiv = df_raw[df_raw['USUBJID'] == individual_id]
-            covariates = self.covariates[self.covariates['USUBJID'] == individual_id] if self.enable_covariates else None
-            # turn covariates into a dictionary
-            covariates = covariates.to_dict(orient='records')[0] if covariates is not None else None
-            # get the exact index
-            idx = self.covariates[self.covariates['USUBJID'] == individual_id].index[0] if self.enable_covariates else None
-            cov_tensor_frame = self.processed_covariates[idx].tensor_frame if self.enable_covariates else None
-            # covarites prompt
-            if covariates is not None:
-                covariates['cov_str'] = f"This is an individual with type I diabetes. Here is the individual's basic information:\n" + str(covariates)
-
-            # turn the time column into a datetime object
-            df_per_indiv[self.time_column] = pd.to_datetime(df_per_indiv[self.time_column])
-            time_diff = df_per_indiv[self.time_column].diff() > pd.Timedelta(self.gap_tolerance)
-            # TODO: if the time difference is greater than the gap tolerance, we combine the two sequences and interpolate the missing values
-
-
-            groups = time_diff.cumsum()
-            list_of_dfs = [group_df for _, group_df in df_per_indiv.groupby(groups)]
-
-            # Interpolate missing values within each group
-            # list_of_dfs = [group_df.set_index(self.time_column).resample('5T').asfreq().interpolate(method='time').reset_index() for group_df in list_of_dfs]
-            
-            # filter out the groups that are too short
-            list_of_dfs = [group_df for group_df in list_of_dfs if len(group_df) >  2 * (self.seq_len + self.pred_len)]
-
-            if self.partition == 'chronological-2':
-                    # train, val, test
-                    border1s = [0, len(list_of_dfs) * self.train_percent // 100, len(list_of_dfs) * (self.train_percent + self.val_percent) // 100]
-                    border2s = [len(list_of_dfs) * self.train_percent // 100, len(list_of_dfs) * (self.train_percent + self.val_percent) // 100, len(list_of_dfs)]
-                    list_of_dfs = list_of_dfs[border1s[self.set_type]:border2s[self.set_type]]
-
-
-            # Create a dataset for each split DataFrame
-            for df_split in list_of_dfs:
-                if self.partition == 'individual' or self.partition == 'chronological-2':
-                    data_set = DatasetPerIndividual(df_split, individual_id, 'train', self.size, self.stride, self.features, self.data_path,
-                                                            self.target, self.scale if self.normalization =='individual' else False, self.timeenc,
-                                                            self.freq, 100, 0, time_column=self.time_column, covariates = covariates, cov_index = idx)
-                    self.datasets.append(data_set) if len(data_set) > 0 else None
-                elif self.partition == 'chronological':
-                    data_set = DatasetPerIndividual(df_split, individual_id, self.flag, self.size, self.stride, self.features, self.data_path,
-                                                            self.target, self.scale if self.normalization =='individual' else False, self.timeenc,
-                                                            self.freq, self.train_percent, self.val_percent, time_column=self.time_column, covariates = covariates, cov_index = idx)
-                    self.datasets.append(data_set) if len(data_set) > 0 else None
-                else:
-                    raise ValueError('Invalid partition type: {}'.format(self.partition))
+        self.__build_window_index__()
+
+    @classmethod
+    def build_splits(cls, flags=('train', 'val', 'test'), **kwargs):
+        """Build one dataset per flag on top of a single parse, normalization and segmentation of the data."""
+        datasets = []
+        source = kwargs.pop('source', None)
+        for flag in flags:
+            datasets.append(cls(flag=flag, source=source, **kwargs))
+            source = datasets[-1].source
+        return tuple(datasets)
 
+    def __read_data__(self):
+        self.segment_ids, self.segment_begins, self.segment_lengths = self.__split_segments__(
+            self.source.individual_segments(self.ids))
+
+    def __split_segments__(self, segment_ids):
+        # segments of this split among segment_ids (grouped by individual), with the first row and number of windows
+        store = self.source.store
+        lengths = store.segment_lengths[segment_ids]
+
+        if self.partition == 'chronological-2':
+            # train, val, test segments of every individual
+            codes = store.segment_individuals[segment_ids]
+            group_starts = np.flatnonzero(np.append(True, codes[1:] != codes[:-1])) if len(codes) else codes
+            group_sizes = np.diff(np.append(group_starts, len(codes)))
+            counts = np.repeat(group_sizes, group_sizes)
+            rank = np.arange(len(codes)) - np.repeat(group_starts, group_sizes)
+            border1s = [0, counts * self.train_percent // 100, counts * (self.train_percent + self.val_percent) // 100]
+            border2s = [counts * self.train_percent // 100, counts * (self.train_percent + self.val_percent) // 100, counts]
+            keep = (rank >= border1s[self.set_type]) & (rank < border2s[self.set_type])
+            segment_ids, lengths = segment_ids[keep], lengths[keep]
+
+        if self.partition == 'chronological':
+            # chronological train, val, test part of every segment
+            num_train = lengths * self.train_percent // 100
+            num_test = lengths * self.val_percent // 100
+            num_vali = lengths - num_train - num_test
+            border1s = [0, num_train - self.seq_len, lengths - num_test - self.seq_len]
+            border2s = [num_train, num_train + num_vali, lengths]
+            border1 = border1s[self.set_type] + np.zeros_like(lengths)
+            border2 = border2s[self.set_type]
+        else:
+            border1 = np.zeros_like(lengths)
+            border2 = lengths
+
+        num_windows = (border2 - border1 - self.seq_len - self.pred_len) // self.stride + 1
+        keep = num_windows > 0
+        return segment_ids[keep], store.segment_starts[segment_ids[keep]] + border1[keep], num_windows[keep]
+
+    def extend(self, segment_ids):
+        """
+        Add the windows of new store segments (see GlucoseSource.append) that belong to the individuals of this
+        split, divided by the partition rule as if they were the only segments. Existing windows keep their
+        index and the new ones follow them, so the cost is O(new windows).
+        """
+        store = self.source.store
+        codes = [self.source.individual_codes[individual_id] for individual_id in self.ids]
+        segment_ids = np.asarray(segment_ids, dtype=np.int64)
+        segment_ids = segment_ids[np.isin(store.segment_individuals[segment_ids], codes)]
+        segment_ids, segment_begins, segment_lengths = self.__split_segments__(segment_ids)
+        num_windows = len(self)
+        self.segment_ids = np.concatenate([self.segment_ids, segment_ids])
+        self.segment_begins = np.concatenate([self.segment_begins, segment_begins])
+        self.segment_lengths = np.concatenate([self.segment_lengths, segment_lengths])
+        self.window_offsets = np.append(self.window_offsets, num_windows + np.cumsum(segment_lengths))
+        if self._window_index is not None:
+            first = len(self.segment_ids) - len(segment_ids)
+            new = np.repeat(np.arange(first, len(self.segment_ids), dtype=np.int32), segment_lengths)
+            starts = (np.arange(num_windows, len(self), dtype=np.int64) - self.window_offsets[new]) * self.stride
+            self._window_index = np.concatenate([self._window_index, np.stack([new, starts.astype(np.int32)], axis=1)])
+
+    def append(self, df_new):
+        """
+        Ingest new readings into the shared source and add their windows to this split; returns the new segment ids,
+        to extend the other splits of the source with. The new windows are the indices from the previous len().
+        """
+        segment_ids = self.source.append(df_new)
+        self.extend(segment_ids)
+        return segment_ids
+
+    def __build_window_index__(self):
+        # window offsets of every segment in the flat index, built once so that a lookup is a binary search
+        self.window_offsets = np.zeros(len(self.segment_ids) + 1, dtype=np.int64)
+        np.cumsum(self.segment_lengths, out=self.window_offsets[1:])
+        self._window_index = None
+
+    @property
+    def window_index(self):
+        """
+        Flat (segment_id, start) int32 table with one row per window, in the same order as __getitem__.
+        segment_id indexes self.segment_ids and start is the first row of the window inside the segment's split.
+        Built lazily for samplers.
+        """
+        if self._window_index is None:
+            segment_ids = np.repeat(np.arange(len(self.segment_ids), dtype=np.int32), self.segment_lengths)
+            starts = (np.arange(len(self), dtype=np.int64) - self.window_offsets[segment_ids]) * self.stride
+            self._window_index = np.stack([segment_ids, starts.astype(np.int32)], axis=1)
+        return self._window_index
+
+    def locate(self, index):
+        # map a flat window index to (segment id, window index within the segment)
+        dataset_idx = np.searchsorted(self.window_offsets, index, side='right') - 1
+        return dataset_idx, index - self.window_offsets[dataset_idx]
 
     def __len__(self):
-        # sum the lengths of all datasets
-        return sum([len(dataset) for dataset in self.datasets])
+        return int(self.window_offsets[-1])
     
     def __getitem__(self, index):
-        # cumsum the lengths of all datasets
-        dataset_cumsum = np.cumsum([0] + [len(dataset) for dataset in self.datasets])
-        # find the dataset index
-        dataset_idx = np.where(index >= dataset_cumsum)[0][-1]
-        # find the index within the dataset
-        dataset_index = index - dataset_cumsum[dataset_idx]
+        if index < 0 or index >= len(self):
+            raise IndexError('index {} is out of range'.format(index))
+        dataset_idx, dataset_index = self.locate(index)
+        store = self.source.store
+        s_begin = self.segment_begins[dataset_idx] + dataset_index * self.stride
+        s_end = s_begin + self.seq_len
+        r_begin = s_end - self.label_len
+        r_end = r_begin + self.label_len + self.pred_len
+
+        windows = (widen(store.values[s_begin:s_end]), widen(store.values[r_begin:r_end]),
+                   store.stamps[s_begin:s_end], store.stamps[r_begin:r_end])
+        if self.return_missing:
+            windows += (self.missing_mask(np.array([r_begin]))[0],)
+
+        individual = store.segment_individuals[self.segment_ids[dataset_idx]]
+        if self.enable_covariates and self.cov_type == 'text':
+            return windows, self.source.covariate_records[individual]
+        elif self.enable_covariates and self.cov_type == 'tensor':
+            return windows, self.source.cov_index[individual]
+        else:
+            return windows
+
+    def __getitems__(self, indices):
+        # batched __getitem__: every array of the batch is gathered at once, see utils.windows.collate_windows
+        indices = np.asarray(indices)
+        if len(indices) and (indices.min() < 0 or indices.max() >= len(self)):
+            raise IndexError('indices are out of range [0, {})'.format(len(self)))
+        dataset_idx, dataset_index = self.locate(indices)
+        store = self.source.store
+        s_begin = self.segment_begins[dataset_idx] + dataset_index * self.stride
+        windows = gather_batch(store.values, store.values, store.stamps, s_begin, self.seq_len, self.label_len,
+                               self.pred_len)
+        if self.return_missing:
+            windows += (self.missing_mask(s_begin + self.seq_len - self.label_len),)
+
+        individuals = store.segment_individuals[self.segment_ids[dataset_idx]]
         if self.enable_covariates and self.cov_type == 'text':
-            return self.datasets[dataset_idx].__getitem__(dataset_index), self.datasets[dataset_idx].covariates
+            return windows, [self.source.covariate_records[i] for i in individuals]
         elif self.enable_covariates and self.cov_type == 'tensor':
-            return self.datasets[dataset_idx].__getitem__(dataset_index), self.datasets[dataset_idx].cov_index
+            return windows, self.source.cov_index[individuals]
         else:
-            # get the item from the dataset
-            return self.datasets[dataset_idx].__getitem__(dataset_index)
+            return windows
+
+    def missing_mask(self, r_begin):
+        # (batch, label_len + pred_len, 1) bool mask of the interpolated rows of the seq_y windows starting at r_begin
+        missing = self.source.store.missing
+        if missing is None:
+            return np.zeros((len(r_begin), self.label_len + self.pred_len, 1), dtype=bool)
+        return gather_windows(missing, r_begin, self.label_len + self.pred_len)[..., None]
+
+    def window_arrays(self):
+        # series, stamps, first row and channel (None: all) of every window in __getitem__ order,
+        # see utils.windows.DeviceWindowLoader
+        store = self.source.store
+        window_index = self.window_index
+        starts = self.segment_begins[window_index[:, 0]] + window_index[:, 1]
+        return store.values, store.values, store.stamps, starts, None
+
+    @property
+    def device_tensors(self):
+        # the splits of a source share its rows, and so their device copies, see utils.windows.DeviceWindowLoader
+        return self.source.store.device_tensors
+
+    def window_covariates(self):
+        # covariate table row of every window in __getitem__ order
+        individuals = self.source.store.segment_individuals[self.segment_ids[self.window_index[:, 0]]]
+        return self.source.cov_index[individuals]
 
     def inverse_transform(self, data):
-        return self.scaler.inverse_transform(data)
+        return self.scaler.inverse_transform(widen(data))
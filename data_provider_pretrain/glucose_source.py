@@ -0,0 +1,701 @@
+import os
+import hashlib
+import pickle
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from sklearn.model_selection import train_test_split
+import torch_frame
+from utils.timefeatures import time_stamps
+from utils.storage import to_storage, publish_once, storage_dtype, cast, widen
+from utils.tables import table_columns, read_table
+
+# bump whenever the layout or the content of the cached arrays changes
+CACHE_VERSION = 5
+
+
+class GlucoseSource:
+    """
+    Parses, normalizes and segments the glucose table once, so that the train/val/test
+    Dataset_Combined views of a run share one copy of the data instead of each re-reading the csv.
+
+    With a cache_dir, the materialized arrays are written to a versioned directory keyed by the content of
+    the input files and every argument that changes them; later runs memory-map that directory instead
+    of preprocessing again, and a changed key simply builds a new one.
+    """
+    def __init__(self, root_path, data_path='Glucose.csv', size=None,
+                 features='S', target='OT', scale=True, train_percent=70, val_percent=20,
+                 partition='chronological', normalization='global',
+                 gap_tolerance='5 minute', time_column='DateTime', timeenc=1, freq='t',
+                 enable_covariates=False, cov_path='final_dm.csv', num_individuals=-1, cache_dir=None,
+                 storage='memory', columns=None, preprocess_workers=0, storage_dtype='float32', cadence=None):
+        if size == None:
+            self.seq_len = 24 * 4 * 4
+            self.pred_len = 24 * 4
+        else:
+            self.seq_len = size[0]
+            self.pred_len = size[2]
+        if partition not in ['individual', 'chronological', 'chronological-2']:
+            raise ValueError('Invalid partition type: {}'.format(partition))
+        self.root_path = root_path
+        self.data_path = data_path
+        self.features = features
+        self.target = target
+        self.scale = scale
+        self.train_percent = train_percent
+        self.val_percent = val_percent
+        self.partition = partition
+        self.normalization = normalization
+        self.gap_tolerance = gap_tolerance
+        # sampling interval the readings are regularized to, gaps up to gap_tolerance are then interpolated
+        self.cadence = cadence
+        if cadence is not None and pd.Timedelta(cadence) > pd.Timedelta(gap_tolerance):
+            raise ValueError('gap_tolerance {} is shorter than the cadence {}'.format(gap_tolerance, cadence))
+        self.time_column = time_column
+        self.timeenc = timeenc
+        self.freq = freq
+        self.enable_covariates = enable_covariates
+        self.cov_path = cov_path
+        self.num_individuals = num_individuals
+        # feature columns used for M/MS besides the target, all columns if None
+        self.columns = columns
+        # processes segmenting the individuals, 0 segments them in this process
+        self.preprocess_workers = preprocess_workers
+        self.cache_dir = cache_dir
+        self.storage = storage
+        # dtype the values and time features are stored in once preprocessed, see utils.storage.storage_dtype
+        self.storage_dtype = storage_dtype
+
+        # shortest segment kept, in rows
+        self.min_length = 2 * (self.seq_len + self.pred_len) + 1
+        # readings that open a segment still shorter than min_length, which later appends may complete
+        self.pending = None
+
+        self.cache_path = self.__cache_path__() if cache_dir is not None else None
+        if self.cache_path is not None:
+            # local rank 0 preprocesses, every rank (and, through pickling by path, every worker) maps the result
+            publish_once(self.cache_path, self.__build_cache__)
+            print('Loading cached data from {}'.format(self.cache_path))
+            self.__load_cache__()
+        else:
+            self.__read_data__()
+        self.individual_codes = {individual_id: code for code, individual_id in enumerate(self.used_ids)}
+
+        if self.enable_covariates:
+            self.covariates = pd.read_csv(os.path.join(self.root_path, self.cov_path))
+            self.covariates_preprocess()
+            individual_covariates = [self.individual_covariates(individual_id) for individual_id in self.used_ids]
+            self.covariate_records = [covariates for covariates, _ in individual_covariates]
+            self.cov_index = np.array([idx for _, idx in individual_covariates], dtype=np.int64)
+
+    def covariates_preprocess(self, cache_path=None):
+        assert self.enable_covariates, 'Covariates are not enabled'
+        # Specify the stype of each column with a dictionary.
+        col_to_stype = {
+            "SEX": torch_frame.categorical,
+            "RACE": torch_frame.categorical,
+            "ETHNIC": torch_frame.categorical,
+            "ARMCD": torch_frame.categorical,
+            "insulin modality": torch_frame.categorical,
+            "AGE": torch_frame.numerical,
+            "WEIGHT": torch_frame.numerical,
+            "HEIGHT": torch_frame.numerical,
+            "HbA1c": torch_frame.numerical,
+            "DIABETES_ONSET": torch_frame.numerical,
+        }
+        dataset = torch_frame.data.Dataset(self.covariates, col_to_stype=col_to_stype)
+        # tensorize the data, reusing the cached tensors when there is a cache
+        cache_path = self.cache_path if cache_path is None else cache_path
+        dataset.materialize(path=os.path.join(cache_path, 'covariates.pt') if cache_path is not None else None)
+        self.processed_covariates = dataset
+
+    def __partition_individuals(self, individual_ids):
+        # Calculate validation and test set percentages
+        val_percent_adj = self.val_percent / (100 - self.train_percent) * 100 if self.train_percent < 100 else self.val_percent
+        test_percent_adj = 100 - val_percent_adj
+
+        # Split the unique IDs into train and temp sets
+        train_ids, temp_ids = train_test_split(individual_ids, train_size=self.train_percent/100, random_state=42)
+
+        # Split the temp set into validation and test sets
+        val_ids, test_ids = train_test_split(temp_ids, test_size=test_percent_adj/100, random_state=42)
+
+        return train_ids, val_ids, test_ids
+
+    def __read_data__(self):
+        path = os.path.join(self.root_path, self.data_path)
+        available = table_columns(path)
+        # sanity checks
+        assert 'USUBJID' in available, 'USUBJID column not found in the dataset'
+        assert self.target in available, 'Target column not found in the dataset'
+        assert self.time_column in available, 'Time column not found in the dataset'
+        if self.features == 'S':
+            feature_columns = []
+        elif self.columns is not None:
+            feature_columns = [col for col in self.columns if col != self.target]
+        else:
+            feature_columns = [col for col in available if col not in [self.time_column, 'USUBJID', self.target]]
+        # Time, USUBJID, feature columns, target column
+        columns = [self.time_column, 'USUBJID'] + feature_columns + [self.target]
+        self.value_columns = columns[2:]
+
+        # with a subset of individuals only their ids are read first, so that the rows of the others are never loaded
+        df_raw = read_table(path, ['USUBJID'] if self.num_individuals >= 0 else columns)
+        individual_ids = df_raw['USUBJID'].unique()
+        if self.partition == 'individual':
+            split_ids = self.__partition_individuals(individual_ids)
+        else:
+            split_ids = (individual_ids, individual_ids, individual_ids)
+        if self.num_individuals >= 0: # -1 means all individuals
+            split_ids = tuple(ids[:self.num_individuals] for ids in split_ids)
+        self.split_ids = dict(zip(['train', 'val', 'test'], split_ids))
+        # every individual used by any split is segmented exactly once
+        self.used_ids = pd.unique(pd.Series([individual_id for ids in split_ids for individual_id in ids]))
+        if self.num_individuals >= 0:
+            df_raw = read_table(path, columns, filter_column='USUBJID', filter_values=self.used_ids)
+
+        print('Loading data into memory...')
+        # the time column is parsed once here, segment_individuals and __trailing_readings__ reuse it
+        df_raw[self.time_column] = pd.to_datetime(df_raw[self.time_column])
+        values, stamps, starts, ends, individuals, missing, last_times = preprocess_individuals_parallel(
+            df_raw, self.used_ids, self.preprocess_workers, self.time_column, self.gap_tolerance,
+            self.min_length, self.value_columns, self.timeenc, self.freq, self.cadence)
+        self.store = SegmentStore(values, stamps, starts, ends, individuals, len(self.used_ids), missing, last_times)
+        self.pending = self.__trailing_readings__(df_raw)
+        del df_raw
+        if self.normalization == 'global' and self.scale:
+            # one scaler for all splits, fitted on the rows of the training windows only
+            self.scaler = self.store.standardize(self.__train_rows__())
+            print('Mean:', self.scaler.mean_)
+            print('Std:', self.scaler.scale_)
+            if self.pending is not None and len(self.pending):
+                self.pending[self.value_columns] = self.scaler.transform(self.pending[self.value_columns].values)
+        if self.normalization == 'individual' and self.scale:
+            # each segment is scaled with the statistics of its own training part
+            train_percent = self.train_percent if self.partition == 'chronological' else 100
+            self.store.normalize_segments(self.store.segment_lengths * train_percent // 100)
+        # only the values are stored in the storage dtype, the fractional timeF stamps stay float32
+        dtype = storage_dtype(self.storage_dtype)
+        if self.cache_dir is None:
+            # a cached store is memory-mapped already
+            self.store.values = to_storage(self.store.values, self.storage, dtype)
+            self.store.stamps = to_storage(self.store.stamps, self.storage)
+        else:
+            self.store.values = cast(self.store.values, dtype)
+
+    def __train_rows__(self):
+        # mask of the store rows the training split of Dataset_Combined draws its windows from; the rows of the
+        # preprocessed segments are stored back to back
+        store = self.store
+        if self.partition == 'chronological':
+            num_train = store.segment_lengths * self.train_percent // 100
+            parts = np.stack([num_train, store.segment_lengths - num_train], axis=1).ravel()
+            return np.repeat(np.tile([True, False], len(store)), parts)
+        if self.partition == 'chronological-2':
+            # the first train_percent of the segments of every individual
+            codes = store.segment_individuals
+            group_starts = np.flatnonzero(np.append(True, codes[1:] != codes[:-1])) if len(codes) else codes
+            group_sizes = np.diff(np.append(group_starts, len(codes)))
+            rank = np.arange(len(codes)) - np.repeat(group_starts, group_sizes)
+            train_segments = rank < np.repeat(group_sizes, group_sizes) * self.train_percent // 100
+        else:
+            train_codes = pd.Categorical(self.split_ids['train'], categories=self.used_ids).codes
+            train_segments = np.isin(store.segment_individuals, train_codes)
+        return np.repeat(train_segments, store.segment_lengths)
+
+    def __cache_path__(self):
+        hasher = hashlib.sha1()
+        files = [self.data_path] + ([self.cov_path] if self.enable_covariates else [])
+        for file in files:
+            with open(os.path.join(self.root_path, file), 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 24), b''):
+                    hasher.update(chunk)
+        # everything that changes the materialized arrays; the window stride only changes the views
+        hasher.update(repr([self.seq_len, self.pred_len, self.features, self.target, self.scale,
+                            self.train_percent, self.val_percent, self.partition, self.normalization,
+                            str(pd.Timedelta(self.gap_tolerance)), self.time_column, self.timeenc, self.freq,
+                            self.num_individuals, self.columns, self.storage_dtype,
+                            None if self.cadence is None else str(pd.Timedelta(self.cadence))]).encode())
+        return os.path.join(self.cache_dir, 'glucose-v{}-{}'.format(CACHE_VERSION, hasher.hexdigest()[:20]))
+
+    def __build_cache__(self):
+        self.__read_data__()
+        self.__save_cache__()
+        # the process that built the cache maps it like every other rank instead of keeping a private copy
+        del self.store
+
+    def __save_cache__(self):
+        # write to a private directory first and move it into place, so readers never see a partial cache
+        tmp_path = '{}.tmp-{}'.format(self.cache_path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        self.store.save(tmp_path)
+        if self.enable_covariates:
+            # the tensorized covariates are published with the arrays, so no rank reads a partially written file
+            self.covariates = pd.read_csv(os.path.join(self.root_path, self.cov_path))
+            self.covariates_preprocess(tmp_path)
+        with open(os.path.join(tmp_path, 'meta.pkl'), 'wb') as f:
+            pickle.dump({'split_ids': self.split_ids, 'used_ids': self.used_ids, 'value_columns': self.value_columns,
+                         'pending': self.pending, 'scaler': getattr(self, 'scaler', None)}, f)
+        try:
+            os.rename(tmp_path, self.cache_path)
+        except OSError:
+            # another process published the same cache first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        print('Cached data to {}'.format(self.cache_path))
+
+    def __load_cache__(self):
+        with open(os.path.join(self.cache_path, 'meta.pkl'), 'rb') as f:
+            meta = pickle.load(f)
+        self.split_ids = meta['split_ids']
+        self.used_ids = meta['used_ids']
+        self.value_columns = meta['value_columns']
+        self.pending = meta['pending']
+        if meta['scaler'] is not None:
+            self.scaler = meta['scaler']
+        self.store = SegmentStore.load(self.cache_path, mmap_mode='r')
+
+    def __trailing_readings__(self, df_raw):
+        # readings after the last kept segment of every individual, i.e. of segments dropped for being shorter than
+        # min_length, which appended readings may still complete; the time column of df_raw is parsed already
+        if self.normalization == 'individual' and self.scale:
+            return None
+        codes = pd.Categorical(df_raw['USUBJID'], categories=self.used_ids).codes.astype(np.int64)
+        times = df_raw[self.time_column].values.view(np.int64)
+        if self.cadence is not None:
+            step = pd.Timedelta(self.cadence).value
+            times = (times + step // 2) // step * step
+        last = self.store.last_segments(np.arange(len(self.used_ids)))
+        latest = np.append(self.store.segment_last_times, np.iinfo(np.int64).min)[last]
+        trailing = (codes >= 0) & (times > latest[np.maximum(codes, 0)])
+        pending = df_raw.loc[trailing, [self.time_column, 'USUBJID'] + self.value_columns].reset_index(drop=True)
+        pending['anchor'] = False
+        return pending
+
+    def append(self, df_new):
+        """
+        Ingest new readings of individuals of the source without re-reading or re-segmenting their history.
+
+        df_new has the USUBJID, time and value columns of the original table. The values are scaled with the frozen
+        global scaler and segmented (and regularized to the cadence) like the original data, with only the last
+        reading of every individual as context, so the cost is O(new readings). A reading within gap_tolerance of
+        the last segment of its individual continues it: since the rows of a segment are contiguous, the
+        continuation becomes a new segment that repeats the last seq_len + pred_len - 1 rows of the old one, which
+        gives exactly the windows that reach into the new readings. Readings after a gap open new segments; one
+        still shorter than min_length is held back until later readings complete it. Readings not later than
+        the last stored or held back reading of their individual are ignored, so an empty batch, or one that
+        repeats readings, changes nothing.
+
+        :return: ids of the new segments of the store, grouped by individual, see Dataset_Combined.extend
+        """
+        if self.normalization == 'individual' and self.scale:
+            raise ValueError('appending needs the frozen global scaler, not per-segment normalization')
+        unknown = ~df_new['USUBJID'].isin(self.individual_codes)
+        if unknown.any():
+            raise ValueError('cannot append readings of unknown individuals: {}'.format(
+                df_new['USUBJID'][unknown].unique()[:5]))
+        store = self.store
+        df = df_new[[self.time_column, 'USUBJID'] + self.value_columns].copy()
+        df[self.time_column] = pd.to_datetime(df[self.time_column])
+        df['anchor'] = False
+        codes = df['USUBJID'].map(self.individual_codes).values.astype(np.int64)
+
+        pending = self.pending if self.pending is not None else df.iloc[:0]
+        has_pending = np.isin(np.arange(len(self.used_ids)), pending['USUBJID'].map(self.individual_codes).values)
+        last = store.last_segments(np.unique(codes))
+        last = last[last >= 0]
+        # readings already covered by the store or held back are dropped, compared on the grid of the cadence
+        def slots(frame):
+            times = frame[self.time_column].values.view(np.int64)
+            if self.cadence is None:
+                return times
+            step = pd.Timedelta(self.cadence).value
+            return (times + step // 2) // step * step
+        latest = np.full(len(self.used_ids), np.iinfo(np.int64).min)
+        latest[store.segment_individuals[last]] = store.segment_last_times[last]
+        np.maximum.at(latest, pending['USUBJID'].map(self.individual_codes).values.astype(np.int64), slots(pending))
+        df = df[slots(df) > latest[codes]].copy()
+        if len(df) == 0:
+            # an empty batch, or one with only readings covered already, changes nothing
+            return np.zeros(0, dtype=np.int64)
+        if self.normalization == 'global' and self.scale:
+            df[self.value_columns] = self.scaler.transform(df[self.value_columns].values)
+
+        # the last reading of every individual is the context of the new ones, unless held back readings follow it
+        last = last[~has_pending[store.segment_individuals[last]]]
+        anchors = pd.DataFrame(widen(np.asarray(store.values[store.segment_ends[last] - 1])),
+                               columns=self.value_columns)
+        anchors.insert(0, 'USUBJID', self.used_ids[store.segment_individuals[last]])
+        anchors.insert(0, self.time_column, store.segment_last_times[last].view('datetime64[ns]'))
+        anchors['anchor'] = True
+
+        held = pending['USUBJID'].isin(df['USUBJID'].unique())
+        combined = pd.concat([pending[held], anchors, df], ignore_index=True)
+        segments, starts, ends, individuals = segment_individuals(combined, self.used_ids, self.time_column,
+                                                                  self.gap_tolerance, 1, self.cadence)
+        continued = segments['anchor'].values[starts]
+        values = np.ascontiguousarray(segments[self.value_columns].values, dtype=np.float32)
+        times = segments[self.time_column].values.view(np.int64)
+        raw_starts, raw_ends, missing = starts, ends, None
+        if self.cadence is not None:
+            values, times, starts, ends, missing = regularize_segments(values, times, starts, ends, self.cadence)
+        stamps = np.array(time_stamps(pd.DatetimeIndex(times.view('datetime64[ns]')), self.timeenc, self.freq))
+
+        # the last segment of an individual in this batch may still grow
+        trailing = np.append(individuals[1:] != individuals[:-1], True)[:len(individuals)]
+        overlap = self.seq_len + self.pred_len - 1
+        pieces, new_segments, held_back = [], [], [pending[~held]]
+        for k in range(len(starts)):
+            if continued[k]:
+                if ends[k] - starts[k] < 2:
+                    continue
+                previous = store.last_segments([individuals[k]])[0]
+                end = store.segment_ends[previous]
+                first = max(store.segment_starts[previous], end - overlap)
+                context = (store.values[first:end], store.stamps[first:end],
+                           None if missing is None else store.missing[first:end])
+                rows = slice(starts[k] + 1, ends[k])
+            elif ends[k] - starts[k] >= self.min_length:
+                context, rows = None, slice(starts[k], ends[k])
+            else:
+                if trailing[k]:
+                    held_back.append(segments.iloc[raw_starts[k]:raw_ends[k]])
+                continue
+            pieces.append((context, rows))
+            new_segments.append((individuals[k], times[ends[k] - 1]))
+        self.pending = pd.concat(held_back, ignore_index=True)
+
+        if not pieces:
+            return np.zeros(0, dtype=np.int64)
+        value_rows, stamp_rows, missing_rows, lengths = [], [], [], []
+        for context, rows in pieces:
+            if context is not None:
+                value_rows.append(context[0])
+                stamp_rows.append(context[1])
+                missing_rows.append(context[2])
+            value_rows.append(cast(values[rows], store.values.dtype))
+            stamp_rows.append(stamps[rows].astype(store.stamps.dtype, copy=False))
+            missing_rows.append(None if missing is None else missing[rows])
+            lengths.append(rows.stop - rows.start + (0 if context is None else len(context[0])))
+        first_row = store.append_rows(np.concatenate(value_rows), np.concatenate(stamp_rows),
+                                      None if missing is None else np.concatenate(missing_rows))
+        segment_ends = first_row + np.cumsum(lengths)
+        individuals, last_times = (np.array(column) for column in zip(*new_segments))
+        return store.append_segments(segment_ends - lengths, segment_ends, individuals, last_times)
+
+    def individual_segments(self, individual_ids):
+        """Store segment ids of the given individuals, grouped by individual in the given order and in time order."""
+        codes = np.array([self.individual_codes[individual_id] for individual_id in individual_ids], dtype=np.int64)
+        first = self.store.individual_offsets[codes]
+        counts = self.store.individual_offsets[codes + 1] - first
+        rank = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.store.segment_order[np.repeat(first, counts) + rank]
+
+    def individual_covariates(self, individual_id):
+        """Covariate record (with its prompt string) and row index in the covariate table of one individual."""
+        if not self.enable_covariates:
+            return None, None
+        covariates = self.covariates[self.covariates['USUBJID'] == individual_id]
+        # get the exact index
+        idx = covariates.index[0]
+        # turn covariates into a dictionary
+        covariates = covariates.to_dict(orient='records')[0]
+        # covarites prompt
+        covariates['cov_str'] = f"This is an individual with type I diabetes. Here is the individual's basic information:\n" + str(covariates)
+        return covariates, idx
+
+
+class SegmentStore:
+    """
+    Columnar storage of the gap-free segments of all individuals.
+
+    The rows of every segment are stored back to back in one value matrix and one time feature matrix
+    (float32 while preprocessing, then the storage dtype of the source); segment k spans rows
+    segment_starts[k]:segment_ends[k] and belongs to the individual with code segment_individuals[k].
+    segment_order lists the segments grouped by individual, in time order: the preprocessed segments are
+    stored that way, segments added by append_segments follow them. Segments regularized to a cadence mark
+    their interpolated rows in missing.
+    """
+    def __init__(self, values, stamps, segment_starts, segment_ends, segment_individuals, num_individuals,
+                 missing=None, segment_last_times=None):
+        self.values = np.ascontiguousarray(values, dtype=np.float32)
+        # calendar stamps (timeenc=0) keep their integer dtype
+        self.stamps = np.ascontiguousarray(stamps, dtype=np.float32 if np.issubdtype(stamps.dtype, np.floating) else None)
+        self.segment_starts = np.asarray(segment_starts, dtype=np.int64)
+        self.segment_ends = np.asarray(segment_ends, dtype=np.int64)
+        self.segment_individuals = np.asarray(segment_individuals, dtype=np.int64)
+        # True for the rows interpolated between readings, None without regularization
+        self.missing = None if missing is None else np.asarray(missing, dtype=bool)
+        # time of the last reading of every segment, as int64 nanoseconds
+        self.segment_last_times = None if segment_last_times is None else np.asarray(segment_last_times, dtype=np.int64)
+        # segments of individual i are segment_order[individual_offsets[i]:individual_offsets[i + 1]]
+        self.segment_order = np.arange(len(self.segment_starts))
+        self.individual_offsets = np.searchsorted(self.segment_individuals, np.arange(num_individuals + 1))
+        # over-allocated row arrays of append_rows
+        self.row_buffers = {}
+        # device copies of the row arrays, shared by the DeviceWindowLoaders of all splits
+        self.device_tensors = {}
+        # per-segment scaler statistics, only set when segments are normalized individually
+        self.segment_mean = None
+        self.segment_scale = None
+        # directory the arrays are memory-mapped from, see load
+        self.path = None
+
+    def __len__(self):
+        return len(self.segment_starts)
+
+    # arrays written by save and read back by load
+    __arrays__ = ['values', 'stamps', 'segment_starts', 'segment_ends', 'segment_individuals', 'individual_offsets',
+                  'segment_mean', 'segment_scale', 'missing', 'segment_last_times']
+
+    def save(self, path):
+        for name in self.__arrays__:
+            if getattr(self, name) is not None:
+                np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Load a saved store; with mmap_mode='r' the arrays are memory-mapped instead of read into memory."""
+        store = cls.__new__(cls)
+        store.path = path if mmap_mode is not None else None
+        store.__load_arrays__(path, mmap_mode)
+        store.segment_order = np.arange(len(store.segment_starts))
+        store.row_buffers = {}
+        store.device_tensors = {}
+        return store
+
+    def __load_arrays__(self, path, mmap_mode=None):
+        for name in self.__arrays__:
+            file = os.path.join(path, name + '.npy')
+            setattr(self, name, np.load(file, mmap_mode=mmap_mode) if os.path.exists(file) else None)
+
+    def __getstate__(self):
+        # a memory-mapped store is pickled by path, so DataLoader workers and spawned processes attach
+        # to the same pages instead of each receiving a copy of the arrays
+        state = self.__dict__.copy()
+        state['row_buffers'] = {}
+        state['device_tensors'] = {}
+        if self.path is not None:
+            for name in self.__arrays__:
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.path is not None:
+            self.__load_arrays__(self.path, mmap_mode='r')
+
+    @property
+    def segment_lengths(self):
+        return self.segment_ends - self.segment_starts
+
+    def last_segments(self, codes):
+        """Id of the latest segment of each individual code, -1 for individuals without segments."""
+        codes = np.asarray(codes, dtype=np.int64)
+        ends = self.individual_offsets[codes + 1]
+        # ends - 1 is -1 for the individuals without segments, which picks the appended -1
+        return np.where(ends > self.individual_offsets[codes], np.append(self.segment_order, -1)[ends - 1], -1)
+
+    def append_rows(self, values, stamps, missing=None):
+        """
+        Add rows after the last row of the store and return the index of the first one. The row arrays are
+        over-allocated so that appends cost O(rows) amortized; the first append to a memory-mapped store
+        copies it into memory.
+        """
+        first = len(self.values)
+        for name, rows in [('values', values), ('stamps', stamps), ('missing', missing)]:
+            array = getattr(self, name)
+            if array is None:
+                continue
+            buffer = self.row_buffers.get(name)
+            if buffer is None or not np.shares_memory(buffer, array) or len(buffer) < first + len(rows):
+                buffer = np.empty((max(2 * (first + len(rows)), 1024),) + array.shape[1:], dtype=array.dtype)
+                buffer[:first] = array
+                self.row_buffers[name] = buffer
+            buffer[first:first + len(rows)] = rows
+            setattr(self, name, buffer[:first + len(rows)])
+        # the store no longer matches the directory it was loaded from, nor the device copies of its arrays
+        self.path = None
+        self.device_tensors = {}
+        return first
+
+    def append_segments(self, segment_starts, segment_ends, segment_individuals, segment_last_times):
+        """Add segments over rows of append_rows, later than the segments of their individuals; returns their ids."""
+        ids = np.arange(len(self), len(self) + len(segment_starts))
+        self.segment_starts = np.concatenate([self.segment_starts, segment_starts]).astype(np.int64)
+        self.segment_ends = np.concatenate([self.segment_ends, segment_ends]).astype(np.int64)
+        self.segment_individuals = np.concatenate([self.segment_individuals, segment_individuals]).astype(np.int64)
+        self.segment_last_times = np.concatenate([self.segment_last_times, segment_last_times]).astype(np.int64)
+        # a stable sort keeps the segments of every individual in time order
+        self.segment_order = np.argsort(self.segment_individuals, kind='stable')
+        self.individual_offsets = np.searchsorted(self.segment_individuals[self.segment_order],
+                                                  np.arange(len(self.individual_offsets)))
+        return ids
+
+    def standardize(self, rows, chunk_rows=1 << 20):
+        """
+        Standardize the values in place with the mean and std of the rows where rows is set, interpolated rows
+        excluded. Both passes go over chunk_rows rows at a time, so only a chunk is ever widened to float64.
+
+        :return: the fitted StandardScaler
+        """
+        if self.missing is not None:
+            rows = rows & ~self.missing
+        scaler = StandardScaler()
+        for begin in range(0, len(self.values), chunk_rows):
+            chunk = self.values[begin:begin + chunk_rows][rows[begin:begin + chunk_rows]]
+            if len(chunk):
+                scaler.partial_fit(chunk)
+        if not hasattr(scaler, 'mean_'):
+            raise ValueError('no training rows to fit the scaler on')
+        for begin in range(0, len(self.values), chunk_rows):
+            self.values[begin:begin + chunk_rows] = scaler.transform(self.values[begin:begin + chunk_rows])
+        return scaler
+
+    def normalize_segments(self, num_train):
+        """Standardize every segment in place with the mean and std of its first num_train[k] rows."""
+        row_segments = np.repeat(np.arange(len(self)), self.segment_lengths)
+        in_train = np.arange(len(self.values)) - self.segment_starts[row_segments] < num_train[row_segments]
+        train_segments = row_segments[in_train]
+        train_values = self.values[in_train].astype(np.float64)
+        counts = np.maximum(num_train, 1)[:, None]
+
+        def segment_sum(columns):
+            return np.stack([np.bincount(train_segments, columns[:, c], minlength=len(self))
+                             for c in range(columns.shape[1])], axis=1)
+
+        mean = segment_sum(train_values) / counts
+        scale = np.sqrt(segment_sum((train_values - mean[train_segments]) ** 2) / counts)
+        # same handling of constant columns as sklearn's StandardScaler
+        scale[scale < 10 * np.finfo(np.float64).eps] = 1.0
+
+        self.segment_mean = mean.astype(np.float32)
+        self.segment_scale = scale.astype(np.float32)
+        self.values -= self.segment_mean[row_segments]
+        self.values /= self.segment_scale[row_segments]
+
+
+def segment_individuals(df_raw, individual_ids, time_column, gap_tolerance, min_length=1, cadence=None):
+    """
+    Split the recordings of the given individuals into gap-free segments without per-individual masks.
+
+    Rows are sorted once by (individual, time), with individuals in the order of individual_ids, and a
+    segment starts wherever the individual changes or consecutive readings are more than gap_tolerance apart.
+    Segments shorter than min_length rows are dropped. With a cadence, reading times are first snapped to
+    multiples of it, only the last reading of a slot is kept and min_length counts the slots a segment spans
+    once regularized (see regularize_segments).
+
+    :return: the rows of the kept segments back to back (with the time column parsed), int64 start and end
+             row offsets of the segments, and the position in individual_ids of the individual of each segment.
+    """
+    codes = pd.Categorical(df_raw['USUBJID'], categories=individual_ids).codes.astype(np.int64)
+    times = pd.to_datetime(df_raw[time_column]).values.view(np.int64)
+    order = np.lexsort((times, codes))
+    order = order[codes[order] >= 0]
+    codes = codes[order]
+    times = times[order]
+    if len(order) == 0:
+        # no readings of the individuals, e.g. an empty preprocessing shard or append batch
+        df = df_raw.iloc[:0].reset_index(drop=True)
+        df[time_column] = times.view('datetime64[ns]')
+        empty = np.zeros(0, dtype=np.int64)
+        return df, empty, empty, empty
+    if cadence is not None:
+        step = pd.Timedelta(cadence).value
+        times = (times + step // 2) // step * step
+        last = np.concatenate([(np.diff(codes) != 0) | (np.diff(times) != 0), [True]])
+        order, codes, times = order[last], codes[last], times[last]
+
+    breaks = (np.diff(codes) != 0) | (np.diff(times) > pd.Timedelta(gap_tolerance).value)
+    starts = np.concatenate([[0], np.flatnonzero(breaks) + 1]).astype(np.int64)
+    ends = np.concatenate([starts[1:], [len(order)]]).astype(np.int64)
+    if cadence is None:
+        keep = (ends - starts) >= min_length
+    else:
+        keep = (times[ends - 1] - times[starts]) // step + 1 >= min_length
+    starts, ends = starts[keep], ends[keep]
+
+    # gather the kept rows with a single take
+    lengths = ends - starts
+    offsets = np.cumsum(lengths) - lengths
+    rows = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    df = df_raw.iloc[order[rows]].reset_index(drop=True)
+    df[time_column] = times[rows].view('datetime64[ns]')
+    return df, offsets, offsets + lengths, codes[starts]
+
+
+def regularize_segments(values, times, starts, ends, cadence):
+    """
+    Resample segments of readings snapped to a cadence (see segment_individuals) onto their full grid.
+
+    All segments are handled at once: every slot between the first and last reading of a segment gets a row, and
+    the slots without a reading are linearly interpolated in time between the readings around them.
+
+    :return: the float32 values and the int64 times of the grid rows, the start and end row offsets of the
+             segments and a bool mask of the interpolated rows.
+    """
+    step = pd.Timedelta(cadence).value
+    lengths = (times[ends - 1] - times[starts]) // step + 1
+    grid_starts = np.cumsum(lengths) - lengths
+    segments = np.repeat(np.arange(len(starts)), ends - starts)
+    # grid row of every reading, increasing across segments since they are laid out back to back
+    positions = grid_starts[segments] + (times - times[starts][segments]) // step
+    rows = np.arange(lengths.sum())
+    previous = np.searchsorted(positions, rows, side='right') - 1
+    following = np.minimum(previous + 1, len(positions) - 1)
+    # the first and last slot of a segment hold readings, so previous and following share the segment of the row
+    span = positions[following] - positions[previous]
+    weight = np.where(span > 0, (rows - positions[previous]) / np.maximum(span, 1), 0.0)[:, None]
+    values = np.asarray(values, dtype=np.float64)
+    grid_values = values[previous] + weight * (values[following] - values[previous])
+    grid_times = times[starts][np.repeat(np.arange(len(starts)), lengths)] + (rows - np.repeat(grid_starts, lengths)) * step
+    return (grid_values.astype(np.float32), grid_times, grid_starts, grid_starts + lengths,
+            positions[previous] != rows)
+
+
+def preprocess_individuals(df_raw, individual_ids, time_column, gap_tolerance, min_length, value_columns, timeenc, freq,
+                           cadence=None):
+    """
+    Segment the recordings of the given individuals (see segment_individuals) and return compact arrays:
+    float32 values of value_columns, time features, segment start and end offsets, segment individuals,
+    the mask of the interpolated rows (None unless the segments are regularized to a cadence) and the time
+    of the last reading of every segment.
+    """
+    df, starts, ends, individuals = segment_individuals(df_raw, individual_ids, time_column, gap_tolerance, min_length,
+                                                        cadence)
+    values = np.ascontiguousarray(df[value_columns].values, dtype=np.float32)
+    times = df[time_column].values.view(np.int64)
+    missing = None
+    if cadence is not None:
+        values, times, starts, ends, missing = regularize_segments(values, times, starts, ends, cadence)
+    stamps = np.array(time_stamps(pd.DatetimeIndex(times.view('datetime64[ns]')), timeenc, freq))
+    return values, stamps, starts, ends, individuals, missing, times[ends - 1]
+
+
+def preprocess_individuals_parallel(df_raw, individual_ids, num_workers, *args):
+    """
+    preprocess_individuals sharded over num_workers processes. The individuals are split into contiguous shards,
+    several per worker to even out their sizes, and the results are concatenated in shard order, so the output
+    is the same as preprocessing all individuals at once.
+    """
+    if num_workers <= 1:
+        return preprocess_individuals(df_raw, individual_ids, *args)
+    shards = [ids for ids in np.array_split(np.asarray(individual_ids), 4 * num_workers) if len(ids)]
+    first_codes = np.cumsum([0] + [len(ids) for ids in shards])
+
+    # rows of every shard with a single sort by individual
+    codes = pd.Categorical(df_raw['USUBJID'], categories=individual_ids).codes
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], first_codes)
+    frames = (df_raw.iloc[order[bounds[k]:bounds[k + 1]]] for k in range(len(shards)))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        results = list(executor.map(preprocess_individuals, frames, shards, *[[arg] * len(shards) for arg in args]))
+
+    values, stamps, starts, ends, individuals, missing, last_times = zip(*results)
+    row_offsets = np.cumsum([0] + [len(v) for v in values])
+    return (np.concatenate(values), np.concatenate(stamps),
+            np.concatenate([s + offset for s, offset in zip(starts, row_offsets)]),
+            np.concatenate([e + offset for e, offset in zip(ends, row_offsets)]),
+            np.concatenate([i + code for i, code in zip(individuals, first_codes)]),
+            None if missing[0] is None else np.concatenate(missing), np.concatenate(last_times))
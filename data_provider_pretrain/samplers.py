@@ -0,0 +1,76 @@
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class WindowSampler(Sampler):
+    """
+    Training windows of a Dataset_Combined drawn per epoch from its window_index, so that long recordings do
+    not dominate an epoch.
+
+    segment_cap keeps at most that many windows of every segment per epoch, a fresh random subset each epoch.
+    balance='individual' (or 'segment') then draws windows so that every individual (or segment) is equally
+    likely, picking a group uniformly and then one of its windows uniformly; otherwise windows are drawn
+    uniformly without replacement. num_samples fixes the epoch length to that many windows (with replacement
+    when it exceeds the windows available); by default an epoch has as many windows as are kept. The draws are
+    seeded by seed + epoch, so every rank of a distributed run draws the same epoch and the DistributedSampler
+    wrappers of Lightning and accelerate shard it.
+    """
+    def __init__(self, dataset, balance=None, segment_cap=None, num_samples=None, seed=None):
+        if balance not in [None, 'individual', 'segment']:
+            raise ValueError('Invalid balance: {}'.format(balance))
+        self.dataset = dataset
+        self.balance = balance
+        self.segment_cap = segment_cap
+        self.num_samples = num_samples
+        self.seed = torch.initial_seed() if seed is None else seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __groups__(self):
+        # segment (position in dataset.segment_ids) and individual code of every window
+        segments = self.dataset.window_index[:, 0].astype(np.int64)
+        individuals = self.dataset.source.store.segment_individuals[self.dataset.segment_ids][segments]
+        return segments, individuals
+
+    def __pool__(self, segments, generator):
+        # windows kept this epoch: at most segment_cap random windows of every segment
+        if not self.segment_cap:
+            return np.arange(len(segments))
+        keys = torch.rand(len(segments), generator=generator).numpy()
+        order = np.lexsort((keys, segments))
+        rank = np.arange(len(order)) - np.searchsorted(segments[order], segments[order])
+        return np.sort(order[rank < self.segment_cap])
+
+    def __len__(self):
+        if self.num_samples:
+            return self.num_samples
+        if not self.segment_cap:
+            return len(self.dataset)
+        return int(np.minimum(self.dataset.segment_lengths, self.segment_cap).sum())
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1
+        segments, individuals = self.__groups__()
+        pool = self.__pool__(segments, generator)
+        num_samples = self.num_samples or len(pool)
+        if len(pool) == 0:
+            return iter([])
+
+        if self.balance is None:
+            if num_samples <= len(pool):
+                picks = torch.randperm(len(pool), generator=generator)[:num_samples].numpy()
+            else:
+                picks = torch.randint(len(pool), (num_samples,), generator=generator).numpy()
+            return iter(pool[picks].tolist())
+
+        # a uniform group, then a uniform window of the group
+        groups = (individuals if self.balance == 'individual' else segments)[pool]
+        order = np.argsort(groups, kind='stable')
+        names, starts, counts = np.unique(groups[order], return_index=True, return_counts=True)
+        group = torch.randint(len(names), (num_samples,), generator=generator).numpy()
+        offset = (torch.rand(num_samples, generator=generator, dtype=torch.float64).numpy() * counts[group]).astype(np.int64)
+        return iter(pool[order[starts[group] + offset]].tolist())
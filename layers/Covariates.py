@@ -0,0 +1,53 @@
+import torch
+from torch_frame import TensorFrame
+
+
+class CovariateEmbeddingCache:
+    """
+    Embeddings of the static covariates of the individuals, looked up by their row in the covariate table.
+
+    Batches give the covariates either as a TensorFrame, which is encoded as is, or as a LongTensor of rows of
+    table (the TensorFrame of all individuals). The feature tensors of every stype of the table are moved to the
+    device of the encoder once, and the rows of a batch are gathered there with one index_select per stype.
+    While the encoder is trained, every distinct individual of the batch is encoded once and the embedding is
+    shared by its windows. In eval mode, or when the encoder is frozen, the whole table is encoded once and
+    embeddings are gathered by index until the encoder parameters change, which the version counters of the
+    parameters reveal after every optimizer step or load_state_dict.
+    """
+    def __init__(self, table=None):
+        self.table = table
+        self.feat_dict = None
+        self.device = None
+        self.embeddings = None
+        self.key = None
+
+    def __gather__(self, rows, device):
+        if self.device != device:
+            self.feat_dict = {stype: feat.to(device) for stype, feat in self.table.feat_dict.items()}
+            self.device = device
+        if rows is None:
+            return TensorFrame(self.feat_dict, self.table.col_names_dict)
+        # multi-nested and multi-embedding features of the text and list stypes are indexed as a whole
+        feat_dict = {stype: feat.index_select(0, rows) if isinstance(feat, torch.Tensor) else feat[rows]
+                     for stype, feat in self.feat_dict.items()}
+        return TensorFrame(feat_dict, self.table.col_names_dict)
+
+    def __call__(self, encoder, covariates):
+        if isinstance(covariates, TensorFrame):
+            return encoder(covariates)
+        # a model rebuilt from cleaned args gets its table back through utils.clean_args.restore_args
+        assert self.table is not None, 'covariate rows given without a covariate table'
+        parameters = list(encoder.parameters())
+        device = parameters[0].device
+        index = covariates.to(device=device, dtype=torch.long, non_blocking=True)
+
+        if encoder.training and torch.is_grad_enabled() and any(p.requires_grad for p in parameters):
+            rows, inverse = torch.unique(index, return_inverse=True)
+            return encoder(self.__gather__(rows, device))[inverse]
+
+        key = (device,) + tuple(p._version for p in parameters)
+        if self.embeddings is None or self.key != key:
+            with torch.no_grad():
+                self.embeddings = encoder(self.__gather__(None, device))
+            self.key = key
+        return self.embeddings.index_select(0, index)
@@ -12,6 +12,7 @@ from torch_frame import TensorFrame, stype
 from torch_frame.data.stats import StatType
 from torch_frame.nn.conv import TabTransformerConv
 from layers.Embed import PatchEmbedding
+from layers.Covariates import CovariateEmbeddingCache
 from torch_frame.nn.encoder import (
     EmbeddingEncoder,
     LinearEncoder,
@@ -145,6 +146,8 @@ class Model(nn.Module):
             col_stats=configs.col_stats,
             col_names_dict=configs.col_names_dict,
         )
+        # covariate embeddings of the individuals, looked up by their row in the covariate table
+        self.cov_cache = CovariateEmbeddingCache(getattr(configs, "cov_frame", None))
         print(self.seq_len)
         print(self.pred_len * self.num_predictions)
         self.Linear_Seasonal = nn.Linear(self.seq_len, self.pred_len * self.num_predictions)
@@ -171,7 +174,7 @@ class Model(nn.Module):
 
     def forward(self, x_enc, x_mark_enc, x_dec, x_mark_dec, mask=None, covariates = None, return_gating_weights=False, return_seperate_head=False):
         # x: [Batch, Input length, Channel]
-        cov_embedding = self.cov_encoder(covariates)
+        cov_embedding = self.cov_cache(self.cov_encoder, covariates)
         x_glucose = x_enc[:,:,-1].unsqueeze(-1)
         x_wearable = x_enc[:,:,:-1]
         x_mark_initial = x_mark_enc[:,0] # Batch, MarkChannel
@@ -15,6 +15,7 @@ from torch_frame import TensorFrame, stype
 from torch_frame.data.stats import StatType
 from torch_frame.nn.conv import TabTransformerConv
 from layers.Embed import DataEmbedding, PatchEmbedding
+from layers.Covariates import CovariateEmbeddingCache
 from torch_frame.nn.encoder import (
     EmbeddingEncoder,
     LinearEncoder,
@@ -166,6 +167,8 @@ class Model(nn.Module):
             col_stats=configs.col_stats,
             col_names_dict=configs.col_names_dict,
         )
+        # covariate embeddings of the individuals, looked up by their row in the covariate table
+        self.cov_cache = CovariateEmbeddingCache(getattr(configs, "cov_frame", None))
         self.z_out = nn.Sequential(
             nn.Linear(configs.d_model, configs.d_model),
             nn.ReLU(),
@@ -194,7 +197,7 @@ class Model(nn.Module):
     def forward(self, x_enc, x_mark_enc, x_dec, x_mark_dec,
                 enc_self_mask=None, dec_self_mask=None, dec_enc_mask=None, covariates=None):
 
-        cov_embedding = self.cov_encoder(covariates)
+        cov_embedding = self.cov_cache(self.cov_encoder, covariates)
         x_raw = x_enc.clone().detach()
 
         # Normalization
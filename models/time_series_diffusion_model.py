@@ -1,6 +1,8 @@
 import pytorch_lightning as pl
 from data_provider.data_factory import data_provider
 from utils.tools import EarlyStopping
+from utils.prefetch import stage_batch
+from utils.clean_args import restore_args
 from utils.metrics import metric
 from torch.optim import lr_scheduler
 from models.model9_NS_transformer.ns_models import ns_Transformer
@@ -36,7 +38,8 @@ def log_normal(x, mu, var):
 class TimeSeriesDiffusionModel(pl.LightningModule):
     def __init__(self, args, train_loader=None, val_loader=None, test_loader=None):
         super(TimeSeriesDiffusionModel, self).__init__()
-        self.args = args
+        # args cleaned for saving lose the covariate table the models look batch rows up in
+        self.args = restore_args(args, train_loader, val_loader, test_loader)
         self.train_loader = train_loader
         self.val_loader = val_loader
         self.test_loader = test_loader
@@ -72,6 +75,12 @@ class TimeSeriesDiffusionModel(pl.LightningModule):
                                                 max_lr=self.args.learning_rate)
         return [optimizer], [scheduler]
 
+    def transfer_batch_to_device(self, batch, device, dataloader_idx):
+        # float32 conversion and decoder input once per batch, as (x, y, x_mark, y_mark, dec_inp, covariates)
+        return stage_batch(batch, device, self.args.label_len, self.args.pred_len,
+                           covariates=self.args.enable_covariates, non_blocking=True,
+                           channel_batch=self.args.channel_batch)
+
     def condition_model_forward(self, batch_x, batch_x_mark, dec_inp, batch_y_mark, covariates=None):
         if self.args.enable_covariates:
             result = self.cond_pred_model(batch_x, batch_x_mark, dec_inp, batch_y_mark, covariates=covariates)
@@ -86,16 +95,7 @@ class TimeSeriesDiffusionModel(pl.LightningModule):
         return y_0_hat_batch, KL_loss, z_sample
 
     def training_step(self, batch, batch_idx):
-        if self.args.enable_covariates:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch[0]
-            batch_cov = batch[1]
-        else:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch
-            batch_cov = None
-
-        # tensor now contains the past 10 days of temperatures followed by 5 zero-initialized time steps.
-        dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
-        dec_inp = torch.cat([batch_y[:, :self.args.label_len, :], dec_inp], dim=1).float().to(self.device)
+        batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, batch_cov = batch
 
         # sample time steps of size batch_size
         f_dim = -1 if self.args.features == 'MS' else 0
@@ -121,14 +121,7 @@ class TimeSeriesDiffusionModel(pl.LightningModule):
 
 
     def sample_step(self, batch, batch_idx):
-        if self.args.enable_covariates:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch[0]
-            batch_cov = batch[1]
-        else:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch
-            batch_cov = None
-        dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
-        dec_inp = torch.cat([batch_y[:, :self.args.label_len, :], dec_inp], dim=1).float()
+        batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, batch_cov = batch
         f_dim = -1 if self.args.features == 'MS' else 0
         y_0_hat_batch, KL_loss, z_sample = self.condition_model_forward(batch_x, batch_x_mark, dec_inp, batch_y_mark, covariates=batch_cov)
         
@@ -160,19 +153,7 @@ class TimeSeriesDiffusionModel(pl.LightningModule):
         # return {'pred': outputs, 'true': batch_y}
     
     def validation_step(self, batch, batch_idx):
-        if self.args.enable_covariates:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch[0]
-            batch_cov = batch[1]
-        else:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch
-            batch_cov = None
-        batch_x = batch_x.float().to(self.device)
-        batch_y = batch_y.float().to(self.device)
-        batch_x_mark = batch_x_mark.float().to(self.device)
-        batch_y_mark = batch_y_mark.float().to(self.device)
-
-        dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
-        dec_inp = torch.cat([batch_y[:, :self.args.label_len, :], dec_inp], dim=1).float().to(self.device)
+        batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, batch_cov = batch
 
         n = batch_x.size(0)
         t = torch.randint(low=0, high=self.model.num_timesteps, size=(n // 2 + 1,)).to(self.device)
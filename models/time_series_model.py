@@ -4,13 +4,16 @@ from torch import nn, optim
 from torch.optim import lr_scheduler
 from models import Autoformer, DLinear, TimeLLM, DLinearChannelMix, DLinearMoE, TimeMixer, DLinearMoECov, Mamba, Koppa, PatchTST, LSTM
 import pytorch_lightning as pl
+from utils.prefetch import stage_batch
+from utils.clean_args import restore_args
 
 
 class TimeSeriesModel(pl.LightningModule):
     def __init__(self, args, train_loader=None, val_loader=None, test_loader=None):
         super().__init__()
         self.save_hyperparameters()
-        self.args = args
+        # args cleaned for saving lose the covariate table the models look batch rows up in
+        self.args = restore_args(args, train_loader, val_loader, test_loader)
         self.train_loader = train_loader
         self.val_loader = val_loader
         self.test_loader = test_loader
@@ -38,6 +41,12 @@ class TimeSeriesModel(pl.LightningModule):
         self.mae_metric = nn.L1Loss()
         self.remove_key = 'llm_model' # remove pretrained model from checkpoint
 
+    def transfer_batch_to_device(self, batch, device, dataloader_idx):
+        # float32 conversion and decoder input once per batch, as (x, y, x_mark, y_mark, dec_inp, covariates)
+        return stage_batch(batch, device, self.args.label_len, self.args.pred_len,
+                           covariates=self.args.enable_covariates, non_blocking=True,
+                           channel_batch=self.args.channel_batch)
+
     def forward(self, batch_x, batch_x_mark, dec_inp, batch_y_mark, batch_cov=None):
         if self.args.output_attention:
             outputs = self.model(batch_x, batch_x_mark, dec_inp, batch_y_mark, covariates=batch_cov)[0]
@@ -45,68 +54,57 @@ class TimeSeriesModel(pl.LightningModule):
             outputs = self.model(batch_x, batch_x_mark, dec_inp, batch_y_mark, covariates=batch_cov)
         return outputs
 
-    def training_step(self, batch, batch_idx):
-        if self.args.enable_covariates:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch[0]
-            batch_cov = batch[1]
-        else:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch
-            batch_cov = None
+    def observed(self, batch):
+        # steps of the predicted part of batch_y that were read rather than interpolated, None without a missing mask
+        return ~batch[6][:, -self.args.pred_len:] if len(batch) > 6 else None
 
-        # decoder input
-        dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float().to(self.device)
-        dec_inp = torch.cat([batch_y[:, :self.args.label_len, :], dec_inp], dim=1).float().to(self.device)
+    def masked_loss(self, metric, outputs, batch_y, observed):
+        # metric over the observed steps only
+        if observed is None:
+            return metric(outputs, batch_y)
+        observed = observed.expand_as(batch_y)
+        return metric(outputs[observed], batch_y[observed])
+
+    def training_step(self, batch, batch_idx):
+        batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, batch_cov = batch[:6]
 
         outputs = self(batch_x, batch_x_mark, dec_inp, batch_y_mark, batch_cov)
         f_dim = -1 if self.args.features == 'MS' else 0
         outputs = outputs[:, -self.args.pred_len:, f_dim:]
         batch_y = batch_y[:, -self.args.pred_len:, f_dim:].to(self.device)
-        loss = self.criterion(outputs, batch_y)
+        loss = self.masked_loss(self.criterion, outputs, batch_y, self.observed(batch))
         self.log("train_loss", loss)
         return loss
 
     def validation_step(self, batch, batch_idx):
-        if self.args.enable_covariates:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch[0]
-            batch_cov = batch[1]
-        else:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch
-            batch_cov = None
-        # decoder input
-        dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float().to(self.device)
-        dec_inp = torch.cat([batch_y[:, :self.args.label_len, :], dec_inp], dim=1).float().to(self.device)
+        batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, batch_cov = batch[:6]
         outputs = self(batch_x, batch_x_mark, dec_inp, batch_y_mark, batch_cov)
         f_dim = -1 if self.args.features == 'MS' else 0
         outputs = outputs[:, -self.args.pred_len:, f_dim:]
         batch_y = batch_y[:, -self.args.pred_len:, f_dim:].to(self.device)
-        loss = self.criterion(outputs, batch_y)
-        mae_loss = self.mae_metric(outputs, batch_y)
+        observed = self.observed(batch)
+        loss = self.masked_loss(self.criterion, outputs, batch_y, observed)
+        mae_loss = self.masked_loss(self.mae_metric, outputs, batch_y, observed)
         self.log("val_loss", loss)
         self.log("val_mae_loss", mae_loss)
 
     def test_step(self, batch, batch_idx):
-        if self.args.enable_covariates:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch[0]
-            batch_cov = batch[1]
-        else:
-            batch_x, batch_y, batch_x_mark, batch_y_mark = batch
-            batch_cov = None
-
-        # decoder input
-        dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float().to(self.device)
-        dec_inp = torch.cat([batch_y[:, :self.args.label_len, :], dec_inp], dim=1).float().to(self.device)
+        batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, batch_cov = batch[:6]
 
         outputs = self(batch_x, batch_x_mark, dec_inp, batch_y_mark, batch_cov)
         f_dim = -1 if self.args.features == 'MS' else 0
         outputs = outputs[:, -self.args.pred_len:, f_dim:]
         batch_y = batch_y[:, -self.args.pred_len:, f_dim:].to(self.device)
-        loss = self.criterion(outputs, batch_y)
-        mae_loss = self.mae_metric(outputs, batch_y)
-
-        mae_loss_0 = self.mae_metric(outputs[:, 0:self.args.pred_len//4, :], batch_y[:, 0:self.args.pred_len//4, :])
-        mae_loss_1 = self.mae_metric(outputs[:, self.args.pred_len//4:self.args.pred_len//2, :], batch_y[:, self.args.pred_len//4:self.args.pred_len//2, :])
-        mae_loss_2 = self.mae_metric(outputs[:, self.args.pred_len//2:3*self.args.pred_len//4, :], batch_y[:, self.args.pred_len//2:3*self.args.pred_len//4, :])
-        mae_loss_3 = self.mae_metric(outputs[:, 3*self.args.pred_len//4:, :], batch_y[:, 3*self.args.pred_len//4:, :])
+        observed = self.observed(batch)
+        loss = self.masked_loss(self.criterion, outputs, batch_y, observed)
+        mae_loss = self.masked_loss(self.mae_metric, outputs, batch_y, observed)
+
+        # mae of every quarter of the horizon
+        quarters = [0, self.args.pred_len//4, self.args.pred_len//2, 3*self.args.pred_len//4, self.args.pred_len]
+        mae_loss_0, mae_loss_1, mae_loss_2, mae_loss_3 = [
+            self.masked_loss(self.mae_metric, outputs[:, a:b, :], batch_y[:, a:b, :],
+                             None if observed is None else observed[:, a:b])
+            for a, b in zip(quarters[:-1], quarters[1:])]
 
 
         self.log("test_loss", loss)
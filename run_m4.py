@@ -21,7 +21,7 @@ import os
 os.environ['CURL_CA_BUNDLE'] = ''
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:64"
 
-from utils.tools import del_files, EarlyStopping, adjust_learning_rate, load_content, test
+from utils.tools import del_files, EarlyStopping, adjust_learning_rate, load_content, test, forecast_last_windows
 
 parser = argparse.ArgumentParser(description='Time-LLM')
 
@@ -60,7 +60,7 @@ parser.add_argument('--checkpoints', type=str, default='./checkpoints/', help='l
 parser.add_argument('--seq_len', type=int, default=96, help='input sequence length')
 parser.add_argument('--label_len', type=int, default=48, help='start token length')
 parser.add_argument('--pred_len', type=int, default=96, help='prediction sequence length')
-parser.add_argument('--seasonal_patterns', type=str, default='Monthly', help='subset for M4')
+parser.add_argument('--seasonal_patterns', type=str, default='Monthly', help='subset for M4, all: run the six subsets one after another')
 
 # model define
 parser.add_argument('--enc_in', type=int, default=7, help='encoder input size')
@@ -86,6 +86,7 @@ parser.add_argument('--llm_dim', type=int, default='4096', help='LLM model dimen
 
 # optimization
 parser.add_argument('--num_workers', type=int, default=10, help='data loader num workers')
+parser.add_argument('--storage', type=str, default='memory', help='dataset storage, options: [memory, memmap]')
 parser.add_argument('--itr', type=int, default=1, help='experiments times')
 parser.add_argument('--train_epochs', type=int, default=10, help='train epochs')
 parser.add_argument('--align_epochs', type=int, default=10, help='alignment epochs')
@@ -106,13 +107,17 @@ ddp_kwargs = DistributedDataParallelKwargs(find_unused_parameters=True)
 deepspeed_plugin = DeepSpeedPlugin(hf_ds_config='./ds_config_zero2.json')
 accelerator = Accelerator(kwargs_handlers=[ddp_kwargs], deepspeed_plugin=deepspeed_plugin)
 
-for ii in range(args.itr):
-    # setting record of experiments
-    setting = '{}_{}_{}_{}_ft{}_sl{}_ll{}_pl{}_dm{}_nh{}_el{}_dl{}_df{}_fc{}_eb{}_{}_{}'.format(
+# every subset of an M4 run with seasonal_patterns all, each trained and forecast as its own run
+seasonal_patterns = M4Meta.seasonal_patterns if args.seasonal_patterns == 'all' else [args.seasonal_patterns]
+for ii, pattern in [(ii, pattern) for ii in range(args.itr) for pattern in seasonal_patterns]:
+    args.seasonal_patterns = pattern
+    # setting record of experiments, with the subset so that every subset keeps its own checkpoint
+    setting = '{}_{}_{}_{}_{}_ft{}_sl{}_ll{}_pl{}_dm{}_nh{}_el{}_dl{}_df{}_fc{}_eb{}_{}_{}'.format(
         args.task_name,
         args.model_id,
         args.model,
         args.data,
+        args.seasonal_patterns,
         args.features,
         args.seq_len,
         args.label_len,
@@ -244,33 +249,13 @@ for ii in range(args.itr):
 
     x, _ = train_loader.dataset.last_insample_window()
     y = test_loader.dataset.timeseries
-    x = torch.tensor(x, dtype=torch.float32).to(accelerator.device)
-    x = x.unsqueeze(-1)
 
     model.eval()
 
     with torch.no_grad():
-        B, _, C = x.shape
-        dec_inp = torch.zeros((B, args.pred_len, C)).float().to(accelerator.device)
-        dec_inp = torch.cat([x[:, -args.label_len:, :], dec_inp], dim=1)
-        outputs = torch.zeros((B, args.pred_len, C)).float().to(accelerator.device)
-        id_list = np.arange(0, B, args.eval_batch_size)
-        id_list = np.append(id_list, B)
-        for i in range(len(id_list) - 1):
-            outputs[id_list[i]:id_list[i + 1], :, :] = model(
-                x[id_list[i]:id_list[i + 1]],
-                None,
-                dec_inp[id_list[i]:id_list[i + 1]],
-                None
-            )
+        preds = forecast_last_windows(args, accelerator, model, x).numpy()
         accelerator.wait_for_everyone()
-        f_dim = -1 if args.features == 'MS' else 0
-        outputs = outputs[:, -args.pred_len:, f_dim:]
-        outputs = outputs.detach().cpu().numpy()
-
-        preds = outputs
         trues = y
-        x = x.detach().cpu().numpy()
 
     accelerator.print('test shape:', preds.shape)
 
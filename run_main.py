@@ -18,6 +18,7 @@ os.environ['CURL_CA_BUNDLE'] = ''
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:64"
 
 from utils.tools import del_files, EarlyStopping, adjust_learning_rate, vali, load_content
+from utils.prefetch import BatchPrefetcher, keep_on_host
 
 parser = argparse.ArgumentParser(description='Time-LLM')
 
@@ -83,6 +84,10 @@ parser.add_argument('--llm_dim', type=int, default='4096', help='LLM model dimen
 
 # optimization
 parser.add_argument('--num_workers', type=int, default=10, help='data loader num workers')
+parser.add_argument('--storage', type=str, default='memory', help='dataset storage, options: [memory, memmap, stream]; stream reads Custom csv files in chunks')
+parser.add_argument('--device_loader', type=int, default=0, help='1: upload every split to the compute device once and form batches there instead of in DataLoader workers, for small models')
+parser.add_argument('--storage_dtype', type=str, default='float32', help='dtype the dataset values are stored in, converted to float32 on the device, options: [float32, float16, bfloat16]')
+parser.add_argument('--channel_batch', type=int, default=0, help='1: one item per time window with all channels of the channel-independent ETT/Custom datasets, folded into channel windows on the device; --batch_size still counts channel windows and must be at least the number of channels')
 parser.add_argument('--itr', type=int, default=1, help='experiments times')
 parser.add_argument('--train_epochs', type=int, default=10, help='train epochs')
 parser.add_argument('--align_epochs', type=int, default=10, help='alignment epochs')
@@ -168,6 +173,7 @@ for ii in range(args.itr):
 
     train_loader, vali_loader, test_loader, model, model_optim, scheduler = accelerator.prepare(
         train_loader, vali_loader, test_loader, model, model_optim, scheduler)
+    keep_on_host(train_loader, vali_loader, test_loader)
 
     if args.use_amp:
         scaler = torch.cuda.amp.GradScaler()
@@ -178,21 +184,13 @@ for ii in range(args.itr):
 
         model.train()
         epoch_time = time.time()
-        for i, (batch_x, batch_y, batch_x_mark, batch_y_mark) in tqdm(enumerate(train_loader)):
+        # float32 batches and decoder inputs staged on the device one step ahead
+        train_batches = BatchPrefetcher(train_loader, accelerator.device, args.label_len, args.pred_len,
+                                        channel_batch=args.channel_batch)
+        for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, _) in tqdm(enumerate(train_batches)):
             iter_count += 1
             model_optim.zero_grad()
 
-            batch_x = batch_x.float().to(accelerator.device)
-            batch_y = batch_y.float().to(accelerator.device)
-            batch_x_mark = batch_x_mark.float().to(accelerator.device)
-            batch_y_mark = batch_y_mark.float().to(accelerator.device)
-
-            # decoder input
-            dec_inp = torch.zeros_like(batch_y[:, -args.pred_len:, :]).float().to(
-                accelerator.device)
-            dec_inp = torch.cat([batch_y[:, :args.label_len, :], dec_inp], dim=1).float().to(
-                accelerator.device)
-
             # encoder - decoder
             if args.use_amp:
                 with torch.cuda.amp.autocast():
@@ -83,6 +83,10 @@ parser.add_argument('--llm_model', type=str, default='LLAMA', help='LLM model')
 parser.add_argument('--llm_dim', type=int, default='4096', help='LLM model dimension')# LLama7b:4096; GPT2-small:768; BERT-base:768
 # optimization
 parser.add_argument('--num_workers', type=int, default=10, help='data loader num workers')
+parser.add_argument('--storage', type=str, default='memory', help='dataset storage, options: [memory, memmap]')
+parser.add_argument('--device_loader', type=int, default=0, help='1: upload every split to the compute device once and form batches there instead of in DataLoader workers, for small models')
+parser.add_argument('--storage_dtype', type=str, default='float32', help='dtype the dataset values are stored in, converted to float32 on the device, options: [float32, float16, bfloat16]')
+parser.add_argument('--channel_batch', type=int, default=0, help='1: one item per time window with all channels of the channel-independent ETT/Custom datasets, folded into channel windows on the device; --batch_size still counts channel windows and must be at least the number of channels')
 parser.add_argument('--itr', type=int, default=1, help='experiments times')
 parser.add_argument('--train_epochs', type=int, default=10, help='train epochs')
 parser.add_argument('--align_epochs', type=int, default=10, help='alignment epochs')
@@ -99,6 +103,14 @@ parser.add_argument('--use_amp', action='store_true', help='use automatic mixed
 parser.add_argument('--llm_layers', type=int, default=6)
 parser.add_argument('--percent', type=int, default=100)
 parser.add_argument('--num_individuals', type=int, default=-1)
+parser.add_argument('--cache_dir', type=str, default=None, help='directory of the preprocessed glucose data cache, built by local rank 0 and memory-mapped by all ranks and workers (e.g. under /dev/shm to keep it in shared memory)')
+parser.add_argument('--data_columns', type=str, default=None, help='comma separated feature columns of the glucose data read for M/MS besides the target, default: all columns')
+parser.add_argument('--preprocess_workers', type=int, default=0, help='processes segmenting the glucose individuals, 0: in the main process')
+parser.add_argument('--gap_tolerance', type=str, default='5 minute', help='longest gap between glucose readings kept within one segment, longer gaps split it')
+parser.add_argument('--cadence', type=str, default=None, help='sampling interval (e.g. 5min) the glucose readings are snapped to, with gaps up to gap_tolerance linearly interpolated; default: keep the raw readings')
+parser.add_argument('--sampler', type=str, default='none', choices=['none', 'individual', 'segment'], help='draw training windows so that every individual or segment is equally likely; none: uniform over windows')
+parser.add_argument('--segment_cap', type=int, default=0, help='at most this many training windows of every segment per epoch, 0: no cap')
+parser.add_argument('--epoch_windows', type=int, default=0, help='training windows drawn per epoch, 0: all windows kept by the sampler')
 parser.add_argument('--enable_covariates', type=int, default=0)
 parser.add_argument('--cov_type', type=str, choices=['text', 'tensor'], default='tensor')
 parser.add_argument('--gradient_accumulation_steps', type=int, default=1)
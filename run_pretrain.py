@@ -18,6 +18,7 @@ os.environ['CURL_CA_BUNDLE'] = ''
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "max_split_size_mb:64"
 
 from utils.tools import del_files, EarlyStopping, adjust_learning_rate, vali, load_content
+from utils.prefetch import BatchPrefetcher, keep_on_host
 
 parser = argparse.ArgumentParser(description='Time-LLM')
 
@@ -84,6 +85,10 @@ parser.add_argument('--llm_dim', type=int, default='4096', help='LLM model dimen
 
 # optimization
 parser.add_argument('--num_workers', type=int, default=10, help='data loader num workers')
+parser.add_argument('--storage', type=str, default='memory', help='dataset storage, options: [memory, memmap]')
+parser.add_argument('--device_loader', type=int, default=0, help='1: upload every split to the compute device once and form batches there instead of in DataLoader workers, for small models')
+parser.add_argument('--storage_dtype', type=str, default='float32', help='dtype the dataset values are stored in, converted to float32 on the device, options: [float32, float16, bfloat16]')
+parser.add_argument('--channel_batch', type=int, default=0, help='1: one item per time window with all channels of the channel-independent ETT/Custom datasets, folded into channel windows on the device; --batch_size still counts channel windows and must be at least the number of channels')
 parser.add_argument('--itr', type=int, default=1, help='experiments times')
 parser.add_argument('--train_epochs', type=int, default=10, help='train epochs')
 parser.add_argument('--align_epochs', type=int, default=10, help='alignment epochs')
@@ -100,6 +105,14 @@ parser.add_argument('--llm_layers', type=int, default=6)
 parser.add_argument('--percent', type=int, default=100)
 parser.add_argument('--wandb_key', type=str, default='6f1080f993d5d7ad6103e69ef57dd9291f1bf366')
 parser.add_argument('--num_individuals', type=int, default=-1)
+parser.add_argument('--cache_dir', type=str, default=None, help='directory of the preprocessed glucose data cache, built by local rank 0 and memory-mapped by all ranks and workers (e.g. under /dev/shm to keep it in shared memory)')
+parser.add_argument('--data_columns', type=str, default=None, help='comma separated feature columns of the glucose data read for M/MS besides the target, default: all columns')
+parser.add_argument('--preprocess_workers', type=int, default=0, help='processes segmenting the glucose individuals, 0: in the main process')
+parser.add_argument('--gap_tolerance', type=str, default='5 minute', help='longest gap between glucose readings kept within one segment, longer gaps split it')
+parser.add_argument('--cadence', type=str, default=None, help='sampling interval (e.g. 5min) the glucose readings are snapped to, with gaps up to gap_tolerance linearly interpolated; default: keep the raw readings')
+parser.add_argument('--sampler', type=str, default='none', choices=['none', 'individual', 'segment'], help='draw training windows so that every individual or segment is equally likely; none: uniform over windows')
+parser.add_argument('--segment_cap', type=int, default=0, help='at most this many training windows of every segment per epoch, 0: no cap')
+parser.add_argument('--epoch_windows', type=int, default=0, help='training windows drawn per epoch, 0: all windows kept by the sampler')
 parser.add_argument('--enable_covariates', type=int, default=0)
 parser.add_argument('--gradient_accumulation_steps', type=int, default=1)
 
@@ -176,6 +189,7 @@ for ii in range(args.itr):
 
     train_loader, vali_loader, test_loader, model, model_optim, scheduler = accelerator.prepare(
         train_loader, vali_loader, test_loader, model, model_optim, scheduler)
+    keep_on_host(train_loader, vali_loader, test_loader)
 
     if args.use_amp:
         scaler = torch.cuda.amp.GradScaler()
@@ -187,26 +201,13 @@ for ii in range(args.itr):
 
         model.train()
         epoch_time = time.time()
-        for i, (data) in enumerate(train_loader):
-            if args.enable_covariates:
-                batch_x, batch_y, batch_x_mark, batch_y_mark = data[0]
-                batch_cov = data[1]
-            else:
-                batch_x, batch_y, batch_x_mark, batch_y_mark = data 
-                batch_cov = None
+        # float32 batches and decoder inputs staged on the device one step ahead, batch_cov is None without covariates
+        train_batches = BatchPrefetcher(train_loader, accelerator.device, args.label_len, args.pred_len,
+                                        covariates=args.enable_covariates, channel_batch=args.channel_batch)
+        for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, batch_cov) in enumerate(train_batches):
             iter_count += 1
             steps += 1
             model_optim.zero_grad()
-            batch_x = batch_x.float().to(accelerator.device)
-            batch_y = batch_y.float().to(accelerator.device)
-            batch_x_mark = batch_x_mark.float().to(accelerator.device)
-            batch_y_mark = batch_y_mark.float().to(accelerator.device)
-
-            # decoder input
-            dec_inp = torch.zeros_like(batch_y[:, -args.pred_len:, :]).float().to(
-                accelerator.device)
-            dec_inp = torch.cat([batch_y[:, :args.label_len, :], dec_inp], dim=1).float().to(
-                accelerator.device)
 
             # encoder - decoder
             if args.use_amp:
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# scripts run by hand against the full glucose dataset
+collect_ignore = ['test_glucose_dataset.py']
+
+
+@pytest.fixture
+def glucose_root(tmp_path):
+    """
+    Directory with a small combined_data.csv and final_dm.csv in the layout of the glucose dataset: irregular
+    5 minute readings of a few individuals, with jittered times, dropped readings and gaps between segments.
+    """
+    rng = np.random.default_rng(0)
+    ids = ['S{:03d}'.format(i) for i in range(5)]
+    frames = []
+    for individual_id in ids:
+        n = int(rng.integers(250, 400))
+        steps = np.full(n, 300.0)
+        steps[rng.choice(n, size=2, replace=False)] = rng.choice([900, 3600, 14400], size=2)
+        times = pd.Timestamp('2021-01-01') + pd.to_timedelta(np.cumsum(steps) + rng.integers(-60, 60, n), unit='s')
+        frames.append(pd.DataFrame({'DateTime': times.strftime('%Y-%m-%d %H:%M:%S'), 'USUBJID': individual_id,
+                                    'HR': rng.normal(70, 10, n), 'Steps': rng.poisson(3, n).astype(float),
+                                    'Glucose': 120 + 30 * np.sin(np.arange(n) / 20) + rng.normal(0, 5, n)}))
+    df = pd.concat(frames)
+    df = df[rng.random(len(df)) > 0.1]
+    df.to_csv(tmp_path / 'combined_data.csv', index=False)
+    pd.DataFrame({'USUBJID': ids, 'SEX': rng.choice(['M', 'F'], len(ids)), 'RACE': rng.choice(['A', 'B'], len(ids)),
+                  'ETHNIC': rng.choice(['X', 'Y'], len(ids)), 'ARMCD': rng.choice(['P', 'Q'], len(ids)),
+                  'insulin modality': rng.choice(['pump', 'mdi'], len(ids)), 'AGE': rng.normal(40, 10, len(ids)),
+                  'WEIGHT': rng.normal(70, 10, len(ids)), 'HEIGHT': rng.normal(170, 10, len(ids)),
+                  'HbA1c': rng.normal(7, 1, len(ids)), 'DIABETES_ONSET': rng.normal(20, 5, len(ids))}
+                 ).to_csv(tmp_path / 'final_dm.csv', index=False)
+    return str(tmp_path)
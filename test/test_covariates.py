@@ -0,0 +1,37 @@
+import argparse
+import copy
+
+import torch
+
+from data_provider_pretrain.data_factory import data_provider
+from models import DLinearMoECov
+from utils.clean_args import clean_args, restore_args
+
+
+def __args__(root_path):
+    return argparse.Namespace(
+        root_path=root_path, data_path='combined_data.csv', seq_len=48, label_len=12, pred_len=12, features='M',
+        target='Glucose', freq='t', embed='timeF', percent=100, seasonal_patterns='Monthly', enc_in=3,
+        enable_covariates=1, cov_type='tensor', num_individuals=-1, cache_dir=None, storage='memory',
+        storage_dtype='float32', data_columns=None, preprocess_workers=0, gap_tolerance='15min', cadence=None,
+        channel_batch=0, device_loader=0, sampler='none', segment_cap=0, epoch_windows=0, mask_missing=0,
+        batch_size=16, num_workers=0, num_nodes=1, num_experts=4, head_dropout=0.1)
+
+
+def test_rebuild_model_from_cleaned_args(glucose_root):
+    torch.manual_seed(0)
+    _, test_loader, args = data_provider(__args__(glucose_root), 'Glucose', 'combined_data.csv', False, 'test')
+    model = DLinearMoECov.Model(args).eval()
+    _, rows = next(iter(test_loader))
+    assert rows.dtype == torch.long
+    with torch.no_grad():
+        expected = model.cov_cache(model.cov_encoder, rows)
+
+    # the hyperparameters saved with a checkpoint, as the training scripts leave them
+    cleaned = clean_args(copy.copy(args))
+    assert cleaned.cov_frame is None and isinstance(cleaned.col_stats, str)
+    rebuilt = DLinearMoECov.Model(restore_args(cleaned, test_loader)).eval()
+    rebuilt.load_state_dict(model.state_dict())
+    with torch.no_grad():
+        embeddings = rebuilt.cov_cache(rebuilt.cov_encoder, rows)
+    assert torch.allclose(embeddings, expected)
@@ -15,12 +15,14 @@ print(len(data_set))
 
 # test data_loader
 from torch.utils.data import DataLoader
+from data_provider_pretrain.data_factory import __build_collate_fn__
 data_loader = DataLoader(
         data_set,
         batch_size=32,
         shuffle=True,
         num_workers=4,
-        drop_last=True)
+        drop_last=True,
+        collate_fn=__build_collate_fn__('tensor'))
 
 next(iter(data_loader))
 for _ in data_loader:
@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_provider_pretrain.data_loader import Dataset_Combined
+from data_provider_pretrain.glucose_source import segment_individuals, preprocess_individuals
+
+
+@pytest.mark.parametrize('cadence', [None, '5min'])
+def test_segment_individuals_empty(cadence):
+    df = pd.DataFrame({'DateTime': pd.Series([], dtype=object), 'USUBJID': pd.Series([], dtype=object),
+                       'Glucose': pd.Series([], dtype=np.float64)})
+    segments, starts, ends, individuals = segment_individuals(df, ['S000'], 'DateTime', '15min', 3, cadence)
+    assert len(segments) == 0 and len(starts) == 0 and len(ends) == 0 and len(individuals) == 0
+
+    values, stamps, starts, ends, individuals, missing, last_times = preprocess_individuals(
+        df, ['S000'], 'DateTime', '15min', 3, ['Glucose'], 1, 't', cadence)
+    assert values.shape == (0, 1) and len(starts) == 0 and len(last_times) == 0
+    assert (missing is None) == (cadence is None)
+
+
+def test_segment_individuals_unknown_individuals(glucose_root):
+    # rows of individuals outside individual_ids are skipped, leaving nothing to segment
+    df = pd.read_csv(glucose_root + '/combined_data.csv')
+    _, starts, ends, _ = segment_individuals(df, ['S999'], 'DateTime', '15min', 3, '5min')
+    assert len(starts) == 0 and len(ends) == 0
+
+
+def __windows__(data_set):
+    # multiset of (individual, window) pairs, independent of the order of the segments
+    windows = data_set.__getitems__(np.arange(len(data_set)))
+    segments = data_set.segment_ids[data_set.locate(np.arange(len(data_set)))[0]]
+    individuals = data_set.source.used_ids[data_set.source.store.segment_individuals[segments]]
+    rows = np.concatenate([np.asarray(window).reshape(len(data_set), -1).astype(np.float64) for window in windows], 1)
+    return sorted((individual, row.round(4).tobytes()) for individual, row in zip(individuals, rows))
+
+
+def __split_table__(root, prefix_root, fraction=0.4):
+    # the readings up to a cut-off time are written to prefix_root, the later ones are returned
+    df = pd.read_csv(os.path.join(root, 'combined_data.csv'))
+    times = pd.to_datetime(df['DateTime'])
+    cut = times.min() + (times.max() - times.min()) * fraction
+    os.makedirs(prefix_root)
+    df[times <= cut].to_csv(os.path.join(prefix_root, 'combined_data.csv'), index=False)
+    return df[times > cut].assign(time=times[times > cut]).sort_values('time').drop(columns='time')
+
+
+@pytest.mark.parametrize('cadence', [None, '5min'])
+def test_append_in_chunks_matches_full_build(glucose_root, cadence):
+    kwargs = dict(data_path='combined_data.csv', target='Glucose', size=[48, 12, 12], features='M', scale=False,
+                  cadence=cadence, gap_tolerance='15min', train_percent=100, val_percent=0, flag='train', timeenc=0)
+    prefix_root = os.path.join(glucose_root, 'prefix')
+    rest = __split_table__(glucose_root, prefix_root)
+    full = Dataset_Combined(root_path=glucose_root, **kwargs)
+    data_set = Dataset_Combined(root_path=prefix_root, **kwargs)
+    data_set.window_index
+    # time ordered chunks, each shuffled
+    for k, chunk in enumerate(np.array_split(rest, 7)):
+        num_windows = len(data_set)
+        segment_ids = data_set.append(chunk.sample(frac=1, random_state=k))
+        assert len(data_set) >= num_windows
+        assert (len(segment_ids) == 0) == (len(data_set) == num_windows)
+    assert np.array_equal(data_set.window_index, np.stack([
+        np.repeat(np.arange(len(data_set.segment_ids)), data_set.segment_lengths),
+        np.concatenate([np.arange(length) for length in data_set.segment_lengths])], axis=1))
+    assert len(data_set) == len(full)
+    assert __windows__(data_set) == __windows__(full)
+
+
+@pytest.mark.parametrize('cadence', [None, '5min'])
+def test_append_empty_batch(glucose_root, cadence):
+    prefix_root = os.path.join(glucose_root, 'prefix')
+    __split_table__(glucose_root, prefix_root)
+    data_set = Dataset_Combined(root_path=prefix_root, data_path='combined_data.csv', target='Glucose',
+                                size=[48, 12, 12], features='M', cadence=cadence, gap_tolerance='15min',
+                                train_percent=100, val_percent=0, flag='train')
+    num_windows, pending = len(data_set), data_set.source.pending.copy()
+    old = pd.read_csv(os.path.join(prefix_root, 'combined_data.csv'))
+    # an empty batch and a batch of readings the source holds already
+    for batch in [old.iloc[:0], old]:
+        segment_ids = data_set.append(batch)
+        assert len(segment_ids) == 0
+        assert len(data_set) == num_windows
+        pd.testing.assert_frame_equal(data_set.source.pending, pending)
+
+
+@pytest.mark.parametrize('cadence', [None, '5min'])
+def test_return_missing(glucose_root, cadence):
+    data_set = Dataset_Combined(root_path=glucose_root, data_path='combined_data.csv', target='Glucose',
+                                size=[48, 12, 12], features='M', cadence=cadence, gap_tolerance='15min', stride=3,
+                                return_missing=True)
+    store = data_set.source.store
+    indices = np.arange(0, len(data_set), 11)
+    windows = data_set.__getitems__(indices)
+    assert len(windows) == 5 and windows[4].dtype == bool and windows[4].shape == windows[1].shape[:2] + (1,)
+    segments, positions = data_set.locate(indices)
+    r_begin = data_set.segment_begins[segments] + positions * data_set.stride + 48 - 12
+    if cadence is None:
+        assert not windows[4].any()
+    else:
+        expected = np.stack([store.missing[begin:begin + 24] for begin in r_begin])[..., None]
+        assert windows[4].any() and np.array_equal(windows[4], expected)
+    assert np.array_equal(data_set[int(indices[1])][4], windows[4][1])
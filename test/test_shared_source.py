@@ -0,0 +1,43 @@
+import os
+import pickle
+import socket
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from data_provider_pretrain.glucose_source import GlucoseSource
+
+
+def __free_port__():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# two CPU ranks with the gloo backend: local rank 0 preprocesses, rank 1 attaches to the published cache
+def run(rank, world_size, port, root_path, cache_dir):
+    os.environ['LOCAL_RANK'] = str(rank)
+    dist.init_process_group('gloo', init_method='tcp://127.0.0.1:{}'.format(port), rank=rank, world_size=world_size)
+    source = GlucoseSource(root_path, data_path='combined_data.csv', target='Glucose', size=[48, 12, 12],
+                           features='M', gap_tolerance='15min', enable_covariates=True, cache_dir=cache_dir)
+    assert isinstance(source.store.values, np.memmap)
+
+    checksum = torch.tensor([float(source.store.values.sum())], dtype=torch.float64)
+    checksums = [torch.zeros_like(checksum) for _ in range(world_size)]
+    dist.all_gather(checksums, checksum)
+    assert all(torch.equal(c, checksum) for c in checksums)
+
+    # DataLoader workers receive the store by path
+    store = pickle.loads(pickle.dumps(source.store))
+    assert store.values.filename == source.store.values.filename
+    assert len(os.listdir(cache_dir)) == 1
+    dist.destroy_process_group()
+
+
+def test_shared_source(glucose_root, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    os.makedirs(cache_dir)
+    # a failing rank makes spawn raise
+    mp.spawn(run, args=(2, __free_port__(), glucose_root, cache_dir), nprocs=2)
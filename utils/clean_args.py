@@ -3,4 +3,22 @@ def clean_args(args):
         args.col_stats = str(args.col_stats) if args.col_stats else None
     if hasattr(args, 'col_names_dict'):
         args.col_names_dict = str(args.col_names_dict) if args.col_names_dict else None
+    if hasattr(args, 'cov_frame'):
+        args.cov_frame = None
+    return args
+
+
+def restore_args(args, *loaders):
+    # undo clean_args for models rebuilt from cleaned or saved hyperparameters: the covariate statistics, column
+    # names and table of tensor covariates are taken again from the data set of the first loader that has them
+    if not getattr(args, 'enable_covariates', False) or getattr(args, 'cov_type', None) != 'tensor' \
+            or getattr(args, 'cov_frame', None) is not None:
+        return args
+    for loader in loaders:
+        covariates = getattr(getattr(loader, 'dataset', None), 'processed_covariates', None)
+        if covariates is not None:
+            args.col_names_dict = covariates.tensor_frame.col_names_dict
+            args.col_stats = covariates.col_stats
+            args.cov_frame = covariates.tensor_frame
+            break
     return args
@@ -0,0 +1,143 @@
+import torch
+from torch.utils.data import DataLoader
+
+
+def decoder_input(batch_y, label_len, pred_len):
+    # the label_len known steps of batch_y followed by pred_len zeros, as fed to the decoders
+    dec_inp = batch_y[:, :label_len + pred_len].clone()
+    dec_inp[:, label_len:] = 0
+    return dec_inp
+
+
+def fold_channels(batch_x, batch_y, batch_x_mark, batch_y_mark):
+    # (B, L, N) windows of all channels as the (B * N, L, 1) channel windows of a channel-independent batch,
+    # each with the stamps of its time window
+    num_channels = batch_x.shape[-1]
+
+    def fold(window):
+        return window.transpose(1, 2).reshape(-1, window.shape[1], 1)
+    return fold(batch_x), fold(batch_y), batch_x_mark.repeat_interleave(num_channels, 0), \
+        batch_y_mark.repeat_interleave(num_channels, 0)
+
+
+def __move__(covariates, device, non_blocking=False):
+    # covariate row indices and TensorFrames go to the device, text covariates stay on the host
+    if hasattr(covariates, 'to'):
+        return covariates.to(device, non_blocking=non_blocking)
+    return covariates
+
+
+def stage_batch(batch, device, label_len, pred_len, covariates=False, non_blocking=False, channel_batch=False):
+    """
+    (batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, batch_cov) of a loader batch, as float32 tensors on
+    device. batch_cov is None unless covariates is set, in which case the batch is ([x, y, x_mark, y_mark], covariates).
+    With channel_batch, the windows of all channels of the batch are folded into single-channel windows. Batches
+    with a fifth window, the missing mask of batch_y (see Dataset_Combined return_missing), get it appended as a
+    bool tensor.
+    """
+    windows, batch_cov = (batch[0], batch[1]) if covariates else (batch, None)
+    # low precision windows are converted after the copy, so they also cross the bus at their storage size
+    batch_x, batch_y, batch_x_mark, batch_y_mark = [
+        torch.as_tensor(window).to(device, non_blocking=non_blocking).float() for window in windows[:4]]
+    if channel_batch:
+        batch_x, batch_y, batch_x_mark, batch_y_mark = fold_channels(batch_x, batch_y, batch_x_mark, batch_y_mark)
+    dec_inp = decoder_input(batch_y, label_len, pred_len)
+    staged = batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, __move__(batch_cov, device, non_blocking)
+    if len(windows) > 4:
+        return staged + (torch.as_tensor(windows[4]).to(device, non_blocking=non_blocking),)
+    return staged
+
+
+def keep_on_host(*loaders):
+    # DataLoaders prepared by accelerate send every batch to the device themselves; leave that to BatchPrefetcher
+    for loader in loaders:
+        if isinstance(loader, DataLoader) and getattr(loader, 'device', None) is not None:
+            loader.device = None
+
+
+class BatchPrefetcher:
+    """
+    Iterate the batches of a loader as stage_batch tuples on device, one batch ahead of the consumer.
+
+    On a GPU, the next batch is copied into one of two pinned host buffers, unless the loader pinned it already,
+    then copied to the device, converted to float32 and given its decoder input on a side stream, overlapping
+    the current step. Elsewhere batches are staged synchronously. Wrap loaders after accelerator.prepare, so the
+    sharding is kept, and keep_on_host them, or their batches arrive on the device already and are only converted.
+    With channel_batch, the batches of a channel-batched dataset are folded into channel windows on the device,
+    see fold_channels.
+    """
+    def __init__(self, loader, device, label_len, pred_len, covariates=False, channel_batch=False):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.label_len = label_len
+        self.pred_len = pred_len
+        self.covariates = covariates
+        self.channel_batch = channel_batch
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if self.device.type != 'cuda':
+            for batch in self.loader:
+                yield stage_batch(batch, self.device, self.label_len, self.pred_len, self.covariates,
+                                  channel_batch=self.channel_batch)
+            return
+
+        stream = torch.cuda.Stream(self.device)
+        buffers = [[None] * 5, [None] * 5]
+        events = [None, None]
+        batches = iter(self.loader)
+
+        def prefetch(slot):
+            batch = next(batches, None)
+            if batch is None:
+                return None
+            windows, batch_cov = (batch[0], batch[1]) if self.covariates else (batch, None)
+            if torch.as_tensor(windows[0]).is_cuda:
+                # batches formed on the device (utils.windows.DeviceWindowLoader) are only converted
+                staged = stage_batch(batch, self.device, self.label_len, self.pred_len, self.covariates,
+                                     channel_batch=self.channel_batch)
+                return list(staged[:5]), staged[5], staged[6:], None
+            # the copy of the batch staged two steps ago must have left this buffer
+            if events[slot] is not None:
+                events[slot].synchronize()
+            host = []
+            for i, window in enumerate(windows):
+                window = torch.as_tensor(window)
+                if window.is_pinned():
+                    # DataLoaders with pin_memory hand out pinned batches already
+                    host.append(window)
+                    continue
+                buffer = buffers[slot][i]
+                if buffer is None or buffer.shape != window.shape or buffer.dtype != window.dtype:
+                    buffer = buffers[slot][i] = torch.empty(window.shape, dtype=window.dtype, pin_memory=True)
+                host.append(buffer.copy_(window))
+            with torch.cuda.stream(stream):
+                staged = [buffer.to(self.device, non_blocking=True).float() for buffer in host[:4]]
+                if self.channel_batch:
+                    staged = list(fold_channels(*staged))
+                staged.append(decoder_input(staged[1], self.label_len, self.pred_len))
+                batch_cov = __move__(batch_cov, self.device, non_blocking=True)
+                # the missing mask of batch_y, if the batch has one
+                missing = tuple(buffer.to(self.device, non_blocking=True) for buffer in host[4:])
+                events[slot] = torch.cuda.Event()
+                events[slot].record(stream)
+            return staged, batch_cov, missing, events[slot]
+
+        slot = 0
+        ready = prefetch(slot)
+        while ready is not None:
+            slot ^= 1
+            upcoming = prefetch(slot)
+            staged, batch_cov, missing, event = ready
+            if event is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_event(event)
+                # tensors made on the side stream are used, and freed, on the compute stream
+                for tensor in staged + list(missing):
+                    tensor.record_stream(current_stream)
+                if isinstance(batch_cov, torch.Tensor):
+                    batch_cov.record_stream(current_stream)
+            yield tuple(staged) + (batch_cov,) + missing
+            ready = upcoming
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+
+# numpy has no bfloat16: bfloat16 arrays hold the upper 16 bits of the float32 values in this one-field dtype,
+# which as_tensor turns into torch.bfloat16 tensors without a copy
+bfloat16 = np.dtype([('bfloat16', '<i2')])
+
+__storage_dtypes__ = {'float32': np.dtype(np.float32), 'float16': np.dtype(np.float16), 'bfloat16': bfloat16}
+
+
+def storage_dtype(name):
+    """numpy dtype of a dataset storage dtype option: float32, float16 or bfloat16."""
+    if name not in __storage_dtypes__:
+        raise ValueError('Invalid storage dtype: {}'.format(name))
+    return __storage_dtypes__[name]
+
+
+def cast(array, dtype=None):
+    """A floating point array converted to dtype (float32, float16 or bfloat16), other arrays unchanged."""
+    array = np.asarray(array)
+    if dtype is None or not np.issubdtype(array.dtype, np.floating):
+        return array
+    if dtype != bfloat16:
+        return array.astype(dtype, copy=False)
+    # round to nearest even on the upper 16 bits
+    bits = np.ascontiguousarray(array, dtype=np.float32).view(np.uint32).astype(np.uint64)
+    bits = (bits + 0x7FFF + ((bits >> 16) & 1)) >> 16
+    return bits.astype(np.uint16).view(bfloat16)
+
+
+def widen(array):
+    """float32 values of a float16 or bfloat16 array, e.g. before inverse_transform; other arrays unchanged."""
+    if not isinstance(array, np.ndarray):
+        return array
+    if array.dtype == bfloat16:
+        return (np.ascontiguousarray(array).view(np.uint16).astype(np.uint32) << 16).view(np.float32)
+    if array.dtype == np.float16:
+        return array.astype(np.float32)
+    return array
+
+
+def as_tensor(array):
+    """Tensor sharing the memory of an array, including bfloat16 ones."""
+    if array.dtype == bfloat16:
+        return torch.from_numpy(np.ascontiguousarray(array).view(np.int16)).view(torch.bfloat16)
+    return torch.from_numpy(np.asarray(array))
+
+
+def to_storage(array, storage='memory', dtype=None):
+    """
+    Back an array by the given storage, converting it to dtype once.
+
+    'memory' keeps the array in process memory. 'memmap' writes it to a .npy file in the temporary
+    directory (TMPDIR) and returns a read-only memory map of it, so DataLoader workers and slices taken
+    in __getitem__ share the page cache instead of each worker holding its own copy. Floating point
+    arrays are converted to dtype (see storage_dtype), or to float32 in a memmap if no dtype is given;
+    integer arrays such as calendar stamps keep their dtype. 'stream' is a memmap for datasets without
+    a chunked reader of their own.
+    """
+    array = np.asarray(array)
+    if dtype is None and storage != 'memory':
+        dtype = np.float32
+    array = cast(array, dtype)
+    if storage == 'memory':
+        return np.ascontiguousarray(array)
+    elif storage in ['memmap', 'stream']:
+        out = allocate_memmap(array.shape, array.dtype)
+        out[...] = array
+        return freeze_memmap(out)
+    else:
+        raise ValueError('Invalid storage type: {}'.format(storage))
+
+
+def allocate_memmap(shape, dtype=np.float32):
+    """Writable array backed by a new .npy file in the temporary directory; fill it, then call freeze_memmap."""
+    with tempfile.NamedTemporaryFile(suffix='.npy', delete=False) as f:
+        path = f.name
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def freeze_memmap(array):
+    """Flush an array from allocate_memmap and return a read-only memory map of its file."""
+    path = array.filename
+    array.flush()
+    del array
+    mapped = np.load(path, mmap_mode='r')
+    # the mapping stays valid after the file is unlinked and is released with the last reference
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+    return mapped
+
+
+def local_rank():
+    # rank of this process on its node, as set by the torchrun, Lightning and accelerate launchers
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def publish_once(path, build, timeout=3600, poll_interval=0.5):
+    """
+    Create path with build() in a single process per node and make the other ranks wait for it.
+
+    build must create path atomically (e.g. by renaming a finished temporary directory), since waiting ranks
+    attach to it as soon as it appears. With torch.distributed initialized the ranks synchronize with a
+    barrier; otherwise, e.g. before Lightning sets up the process group, local ranks other than 0 poll for path.
+    """
+    if local_rank() == 0 and not os.path.exists(path):
+        build()
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        torch.distributed.barrier()
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if time.time() > deadline:
+            raise TimeoutError('Timed out waiting for {} to be published by local rank 0'.format(path))
+        time.sleep(poll_interval)
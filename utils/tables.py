@@ -0,0 +1,48 @@
+import os
+
+import pandas as pd
+
+# pyarrow.dataset formats of the columnar file extensions, everything else is read as csv
+__arrow_formats__ = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'ipc', '.ipc': 'ipc'}
+
+
+def __arrow_dataset__(path):
+    fmt = __arrow_formats__.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        return None
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise ImportError('pyarrow is required to read {}'.format(path))
+    return ds.dataset(path, format=fmt)
+
+
+def table_columns(path):
+    """Column names of a csv, Parquet, Feather or Arrow IPC file, read without loading any rows."""
+    dataset = __arrow_dataset__(path)
+    if dataset is None:
+        return list(pd.read_csv(path, nrows=0).columns)
+    return list(dataset.schema.names)
+
+
+def read_table(path, columns=None, filter_column=None, filter_values=None, chunksize=1000000):
+    """
+    Read a csv, Parquet, Feather or Arrow IPC file (chosen by extension) into a DataFrame.
+
+    Only the given columns are read, in the given order (all columns if None). With filter_column, only rows
+    whose value is in filter_values are kept: the columnar formats push the filter down into the scan, a csv is
+    filtered chunksize rows at a time. Timestamp columns of the columnar formats come back as datetime64 without
+    any string parsing.
+    """
+    dataset = __arrow_dataset__(path)
+    if dataset is not None:
+        import pyarrow.dataset as ds
+        predicate = ds.field(filter_column).isin(list(filter_values)) if filter_column is not None else None
+        return dataset.to_table(columns=columns, filter=predicate).to_pandas()
+
+    if filter_column is None:
+        df = pd.read_csv(path, usecols=columns)
+    else:
+        chunks = pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        df = pd.concat([chunk[chunk[filter_column].isin(filter_values)] for chunk in chunks], ignore_index=True)
+    return df if columns is None else df[columns]
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+from functools import lru_cache
 from typing import List
 
 import numpy as np
@@ -130,5 +132,83 @@ def time_features_from_frequency_str(freq_str: str) -> List[TimeFeature]:
     raise RuntimeError(supported_freq_msg)
 
 
+@lru_cache(maxsize=None)
+def __time_feature_list__(freq_str):
+    # the feature instances of a frequency are stateless, so they are built once per frequency string
+    return tuple(time_features_from_frequency_str(freq_str))
+
+
+# features of the most recently encoded evenly spaced timestamp grids, see time_features and calendar_features
+__feature_memo__ = OrderedDict()
+__feature_memo_size__ = 32
+
+
+def __grid_key__(dates):
+    # (start, step, length) of an evenly spaced DatetimeIndex, None if the index is empty or irregular
+    if not len(dates):
+        return None
+    steps = np.diff(dates.asi8)
+    if len(steps) and (steps != steps[0]).any():
+        return None
+    return dates[0], int(steps[0]) if len(steps) else 0, len(dates)
+
+
+def __memoized__(key, build):
+    # build() once per key; results are read-only since they are shared between callers
+    if key[1] is None:
+        return build()
+    if key in __feature_memo__:
+        __feature_memo__.move_to_end(key)
+        return __feature_memo__[key]
+    features = build()
+    features.flags.writeable = False
+    __feature_memo__[key] = features
+    if len(__feature_memo__) > __feature_memo_size__:
+        __feature_memo__.popitem(last=False)
+    return features
+
+
 def time_features(dates, freq='h'):
-    return np.vstack([feat(dates) for feat in time_features_from_frequency_str(freq)])
\ No newline at end of file
+    """
+    Features of freq for a DatetimeIndex as a float32 (num_features, len(dates)) matrix.
+    Compute them once for all timestamps of a dataset and slice the result, rather than calling this per segment.
+    Evenly spaced grids are memoized by (start, step, length, freq).
+    """
+    dates = pd.DatetimeIndex(dates)
+
+    def build():
+        features = __time_feature_list__(freq)
+        out = np.empty((len(features), len(dates)), dtype=np.float32)
+        for i, feat in enumerate(features):
+            out[i] = feat(dates)
+        return out
+
+    return __memoized__(('time', __grid_key__(dates), freq), build)
+
+
+def calendar_features(dates, minute_step=None):
+    """
+    Month, day, weekday and hour of a DatetimeIndex, plus minute // minute_step if minute_step is given,
+    as an int8 matrix of shape (len(dates), num_features). This is the timeenc=0 encoding of the datasets,
+    read from the DatetimeIndex fields in one pass instead of one apply per field and row.
+    Evenly spaced grids are memoized like time_features; the returned matrix may be read-only.
+    """
+    dates = pd.DatetimeIndex(dates)
+
+    def build():
+        fields = [dates.month, dates.day, dates.weekday, dates.hour]
+        if minute_step is not None:
+            fields.append(dates.minute // minute_step)
+        stamps = np.empty((len(dates), len(fields)), dtype=np.int8)
+        for i, field in enumerate(fields):
+            stamps[:, i] = field
+        return stamps
+
+    return __memoized__(('calendar', __grid_key__(dates), minute_step), build)
+
+
+def time_stamps(dates, timeenc, freq='h', minute_step=None):
+    """Time features of a DatetimeIndex as a (len(dates), num_features) matrix for either timeenc."""
+    if timeenc == 0:
+        return calendar_features(dates, minute_step)
+    return time_features(dates, freq=freq).transpose(1, 0)
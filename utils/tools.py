@@ -5,6 +5,8 @@ import shutil
 
 from tqdm import tqdm
 
+from utils.prefetch import BatchPrefetcher
+
 plt.switch_backend('agg')
 
 
@@ -139,17 +141,9 @@ def vali(args, accelerator, model, vali_data, vali_loader, criterion, mae_metric
     total_mae_loss = []
     model.eval()
     with torch.no_grad():
-        for i, (batch_x, batch_y, batch_x_mark, batch_y_mark) in tqdm(enumerate(vali_loader)):
-            batch_x = batch_x.float().to(accelerator.device)
-            batch_y = batch_y.float()
-
-            batch_x_mark = batch_x_mark.float().to(accelerator.device)
-            batch_y_mark = batch_y_mark.float().to(accelerator.device)
-
-            # decoder input
-            dec_inp = torch.zeros_like(batch_y[:, -args.pred_len:, :]).float()
-            dec_inp = torch.cat([batch_y[:, :args.label_len, :], dec_inp], dim=1).float().to(
-                accelerator.device)
+        vali_batches = BatchPrefetcher(vali_loader, accelerator.device, args.label_len, args.pred_len,
+                                       channel_batch=args.channel_batch)
+        for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, dec_inp, _) in tqdm(enumerate(vali_batches)):
             # encoder - decoder
             if args.use_amp:
                 with torch.cuda.amp.autocast():
@@ -186,38 +180,50 @@ def vali(args, accelerator, model, vali_data, vali_loader, criterion, mae_metric
     return total_loss, total_mae_loss
 
 
+def forecast_last_windows(args, accelerator, model, x):
+    """
+    Forecast pred_len steps after each of the (N, seq_len) insample windows x with an eval-mode model.
+
+    Chunks of eval_batch_size windows are copied from a pinned host buffer to the device and their forecasts back
+    into a pinned host buffer without blocking, so only one chunk is held on the device at a time.
+    Returns the float32 forecasts (N, pred_len, 1) as a host tensor.
+    """
+    device = accelerator.device
+    pin = device.type == 'cuda'
+    x = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32)).unsqueeze(-1)
+    if pin:
+        x = x.pin_memory()
+    B, _, C = x.shape
+    outputs = torch.empty((B, args.pred_len, C), dtype=torch.float32, pin_memory=pin)
+    f_dim = -1 if args.features == 'MS' else 0
+    for start in range(0, B, args.eval_batch_size):
+        batch_x = x[start:start + args.eval_batch_size].to(device, non_blocking=True)
+        dec_inp = torch.zeros((batch_x.shape[0], args.pred_len, C), device=device)
+        dec_inp = torch.cat([batch_x[:, -args.label_len:, :], dec_inp], dim=1)
+        batch_out = model(batch_x, None, dec_inp, None)
+        outputs[start:start + batch_x.shape[0]].copy_(batch_out[:, -args.pred_len:, f_dim:], non_blocking=True)
+    if pin:
+        torch.cuda.synchronize(device)
+    return outputs
+
+
 def test(args, accelerator, model, train_loader, vali_loader, criterion):
     x, _ = train_loader.dataset.last_insample_window()
     y = vali_loader.dataset.timeseries
-    x = torch.tensor(x, dtype=torch.float32).to(accelerator.device)
-    x = x.unsqueeze(-1)
 
     model.eval()
     with torch.no_grad():
-        B, _, C = x.shape
-        dec_inp = torch.zeros((B, args.pred_len, C)).float().to(accelerator.device)
-        dec_inp = torch.cat([x[:, -args.label_len:, :], dec_inp], dim=1)
-        outputs = torch.zeros((B, args.pred_len, C)).float().to(accelerator.device)
-        id_list = np.arange(0, B, args.eval_batch_size)
-        id_list = np.append(id_list, B)
-        for i in range(len(id_list) - 1):
-            outputs[id_list[i]:id_list[i + 1], :, :] = model(
-                x[id_list[i]:id_list[i + 1]],
-                None,
-                dec_inp[id_list[i]:id_list[i + 1]],
-                None
-            )
+        outputs = forecast_last_windows(args, accelerator, model, x).to(accelerator.device)
         accelerator.wait_for_everyone()
         outputs = accelerator.gather_for_metrics(outputs)
-        f_dim = -1 if args.features == 'MS' else 0
-        outputs = outputs[:, -args.pred_len:, f_dim:]
         pred = outputs
+        x = torch.tensor(x, dtype=torch.float32).to(accelerator.device)
         true = torch.from_numpy(np.array(y)).to(accelerator.device)
         batch_y_mark = torch.ones(true.shape).to(accelerator.device)
         true = accelerator.gather_for_metrics(true)
         batch_y_mark = accelerator.gather_for_metrics(batch_y_mark)
 
-        loss = criterion(x[:, :, 0], args.frequency_map, pred[:, :, 0], true, batch_y_mark)
+        loss = criterion(x, args.frequency_map, pred[:, :, 0], true, batch_y_mark)
 
     model.train()
     return loss
@@ -0,0 +1,168 @@
+import numpy as np
+import torch
+
+from utils.storage import local_rank, as_tensor, widen
+
+
+def gather_windows(array, starts, length, columns=None):
+    """
+    Stack the windows array[s:s + length] of every start s with a single fancy-index gather.
+
+    With columns, window i only keeps column columns[i] (as a trailing axis of size 1), which is how the
+    channel-independent datasets address one channel per item.
+    """
+    rows = np.asarray(starts)[:, None] + np.arange(length)
+    if columns is None:
+        return array[rows]
+    return array[rows, np.asarray(columns)[:, None]][..., None]
+
+
+def gather_batch(data_x, data_y, data_stamp, s_begin, seq_len, label_len, pred_len, columns=None):
+    """
+    (seq_x, seq_y, seq_x_mark, seq_y_mark) of the windows starting at rows s_begin, as in __getitem__ but stacked.
+    Values keep their storage dtype, see utils.storage.storage_dtype; columns as in gather_windows.
+    """
+    r_begin = np.asarray(s_begin) + seq_len - label_len
+    return (gather_windows(data_x, s_begin, seq_len, columns),
+            gather_windows(data_y, r_begin, label_len + pred_len, columns),
+            gather_windows(data_stamp, s_begin, seq_len),
+            gather_windows(data_stamp, r_begin, label_len + pred_len))
+
+
+class ChannelWindows:
+    """
+    Window access of the channel-independent datasets (ETT, Custom), which hold data_x, data_y and data_stamp
+    arrays and tot_len windows per channel: item index is feat_id * tot_len + start, and every item is the window
+    of one of the enc_in channels, or of all of them with channel_batch.
+    """
+    def __getitem__(self, index):
+        feat_id = index // self.tot_len
+        s_begin = index % self.tot_len
+        channels = slice(None) if self.channel_batch else slice(feat_id, feat_id + 1)
+
+        s_end = s_begin + self.seq_len
+        r_begin = s_end - self.label_len
+        r_end = r_begin + self.label_len + self.pred_len
+        # single windows come back as float32 arrays, batches of __getitems__ keep the storage dtype
+        seq_x = widen(self.data_x[s_begin:s_end, channels])
+        seq_y = widen(self.data_y[r_begin:r_end, channels])
+        seq_x_mark = self.data_stamp[s_begin:s_end]
+        seq_y_mark = self.data_stamp[r_begin:r_end]
+
+        return seq_x, seq_y, seq_x_mark, seq_y_mark
+
+    def __getitems__(self, indices):
+        # batched __getitem__: every array of the batch is gathered at once, see collate_windows
+        indices = np.asarray(indices)
+        return gather_batch(self.data_x, self.data_y, self.data_stamp, indices % self.tot_len, self.seq_len,
+                            self.label_len, self.pred_len, None if self.channel_batch else indices // self.tot_len)
+
+    def window_arrays(self):
+        # series, stamps, first row and channel (None: all) of every window in __getitem__ order,
+        # see DeviceWindowLoader
+        indices = np.arange(len(self))
+        return self.data_x, self.data_y, self.data_stamp, indices % self.tot_len, \
+            None if self.channel_batch else indices // self.tot_len
+
+    def __len__(self):
+        return (len(self.data_x) - self.seq_len - self.pred_len + 1) * (1 if self.channel_batch else self.enc_in)
+
+
+def collate_windows(windows):
+    """Collate for datasets whose __getitems__ already returns stacked batches: only wraps them as tensors."""
+    return [as_tensor(np.asarray(window)) for window in windows]
+
+
+def __to_device__(array, device, device_tensors):
+    # device_tensors maps host arrays to their device copies; each entry keeps its array alive so that the
+    # address in the key cannot be reused
+    key = (array.__array_interface__['data'][0], array.shape, array.strides, array.dtype.str, str(device))
+    if key not in device_tensors:
+        # read-only memory maps are copied to host memory once on the way
+        tensor = as_tensor(np.require(array, requirements=['C', 'W'])).to(device)
+        device_tensors[key] = array, tensor
+    return device_tensors[key][1]
+
+
+class DeviceWindowLoader:
+    """
+    Batches of a windowed dataset formed on the compute device, in place of a DataLoader.
+
+    The series, stamps and window starts of the dataset (its window_arrays) are uploaded once; the windows of a
+    batch are then gathered there by index arithmetic, without worker processes, collate or host to device copies.
+    Batches have the layout of the DataLoader ones: [x, y, x_mark, y_mark], or ([x, y, x_mark, y_mark], covariates)
+    when per-window covariate rows are given. Under torch.distributed every rank iterates its own shard of an
+    epoch-seeded permutation, like DistributedSampler, or of the windows drawn by sampler when one is given (see
+    data_provider_pretrain.samplers). The device defaults to the GPU of the local rank, else the CPU.
+
+    Datasets whose splits share their arrays expose a device_tensors dict, which holds the device copies for
+    the loaders of all splits and lives as long as the arrays; the copies of other datasets live with the loader.
+    """
+    def __init__(self, dataset, batch_size, shuffle=False, drop_last=False, device=None, covariates=None, seed=None,
+                 sampler=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.device = device
+        self.covariates = covariates
+        self.sampler = sampler
+        self.seed = torch.initial_seed() if seed is None else seed
+        self.epoch = 0
+        self.tensors = None
+
+    def __upload__(self):
+        if self.device is None:
+            self.device = 'cuda:{}'.format(local_rank()) if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(self.device)
+        arrays = self.dataset.window_arrays() + (self.covariates,)
+        device_tensors = getattr(self.dataset, 'device_tensors', {})
+        self.tensors = [None if array is None else __to_device__(np.asarray(array), self.device, device_tensors)
+                        for array in arrays]
+
+    def __shard__(self):
+        # (rank, number of ranks) of this process
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return 0, 1
+
+    def __len__(self):
+        rank, world_size = self.__shard__()
+        num_windows = (len(self.dataset) if self.sampler is None else len(self.sampler)) // world_size
+        if self.drop_last:
+            return num_windows // self.batch_size
+        return (num_windows + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.tensors is None:
+            self.__upload__()
+        data_x, data_y, data_stamp, starts, columns, covariates = self.tensors
+        seq_len = self.dataset.seq_len
+        y_len = self.dataset.label_len + self.dataset.pred_len
+        x_steps = torch.arange(seq_len, device=self.device)
+        y_steps = torch.arange(y_len, device=self.device)
+
+        rank, world_size = self.__shard__()
+        if self.sampler is not None:
+            order = torch.as_tensor(list(self.sampler), dtype=torch.long)
+        elif self.shuffle:
+            generator = torch.Generator().manual_seed(self.seed + self.epoch)
+            order = torch.randperm(len(starts), generator=generator)
+        else:
+            order = torch.arange(len(starts))
+        num_windows = len(order)
+        order = order[rank:num_windows - num_windows % world_size:world_size].to(self.device)
+        self.epoch += 1
+
+        for batch in range(len(self)):
+            index = order[batch * self.batch_size:(batch + 1) * self.batch_size]
+            s_begin = starts[index][:, None]
+            s_rows = s_begin + x_steps
+            r_rows = s_begin + (seq_len - self.dataset.label_len) + y_steps
+            if columns is None:
+                seq_x, seq_y = data_x[s_rows], data_y[r_rows]
+            else:
+                column = columns[index][:, None]
+                seq_x, seq_y = data_x[s_rows, column][..., None], data_y[r_rows, column][..., None]
+            windows = [seq_x, seq_y, data_stamp[s_rows], data_stamp[r_rows]]
+            yield windows if covariates is None else (windows, covariates[index])